@@ -0,0 +1,2 @@
+-- Per-match summary stats, calculated by the backend whenever periods are written
+ALTER TABLE matchdb ADD COLUMN IF NOT EXISTS summary JSONB;
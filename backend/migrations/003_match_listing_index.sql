@@ -0,0 +1,2 @@
+-- Serves the keyset pagination of the match listing
+CREATE INDEX IF NOT EXISTS ix_matchdb_user_id_date_match_id ON matchdb (user_id, date, match_id);
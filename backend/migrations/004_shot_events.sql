@@ -0,0 +1,21 @@
+-- Normalized copy of the shots in matchdb.periods. Fill it for existing matches with `python src/shot_events.py`.
+CREATE TABLE IF NOT EXISTS shotevent (
+    id SERIAL PRIMARY KEY,
+    match_id VARCHAR NOT NULL REFERENCES matchdb(match_id) ON DELETE CASCADE,
+    user_id VARCHAR NOT NULL,
+    date DATE NOT NULL,
+    period VARCHAR NOT NULL,
+    action_index INTEGER NOT NULL,
+    team VARCHAR NOT NULL,
+    x FLOAT NOT NULL,
+    y FLOAT NOT NULL,
+    shot_type VARCHAR NOT NULL,
+    is_header BOOLEAN NOT NULL,
+    assist_type VARCHAR,
+    assist_x FLOAT,
+    assist_y FLOAT
+);
+
+CREATE INDEX IF NOT EXISTS ix_shotevent_match_id ON shotevent (match_id);
+CREATE INDEX IF NOT EXISTS ix_shotevent_user_id_team_shot_type ON shotevent (user_id, team, shot_type);
+CREATE INDEX IF NOT EXISTS ix_shotevent_user_id_date ON shotevent (user_id, date);
@@ -0,0 +1,2 @@
+-- Set on every write of a match, used for ETags
+ALTER TABLE matchdb ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
@@ -0,0 +1,2 @@
+-- xG of each shot event for season analytics. Fill it for existing matches with `python src/shot_events.py`.
+ALTER TABLE shotevent ADD COLUMN IF NOT EXISTS xg FLOAT NOT NULL DEFAULT 0;
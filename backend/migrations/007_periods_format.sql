@@ -0,0 +1,4 @@
+-- How matchdb.periods is stored. Existing matches keep their pixel coordinates.
+-- Shot event coordinates are now normalized: rebuild them with `python src/shot_events.py`.
+ALTER TABLE matchdb ADD COLUMN IF NOT EXISTS periods_format VARCHAR NOT NULL DEFAULT 'pixels';
+ALTER TABLE matchdb ALTER COLUMN periods_format DROP DEFAULT;
@@ -0,0 +1,3 @@
+-- xg.XG_MODELS version of each match's stored xG. Summaries so far were all calculated with version 1.
+ALTER TABLE matchdb ADD COLUMN IF NOT EXISTS xg_model_version INTEGER;
+UPDATE matchdb SET xg_model_version = 1 WHERE summary IS NOT NULL AND xg_model_version IS NULL;
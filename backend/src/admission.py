@@ -0,0 +1,157 @@
+import asyncio
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+import math
+import os
+import time
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+load_dotenv()
+# Sustained requests per second allowed per user, and how many may come at once after being idle
+ADMISSION_RATE = float(os.environ.get("ADMISSION_RATE", "10"))
+ADMISSION_BURST = int(os.environ.get("ADMISSION_BURST", "20"))
+# Requests of one user handled at the same time, each may hold a pooled DB connection
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "4"))
+# How long a request may wait for one of the user's in-flight slots before it is rejected, 0 to never wait
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", "0.05"))
+
+
+class _UserState:
+    def __init__(self, burst: int, max_in_flight: int):
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.slots = asyncio.Semaphore(max_in_flight)
+
+
+class AdmissionSlot:
+    """
+    In-flight slot of an admitted request. release() may be called more than once, only the first call counts.
+    """
+
+    def __init__(self, semaphore: asyncio.Semaphore):
+        self._semaphore = semaphore
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self._semaphore.release()
+
+
+async def release_after(chunks: AsyncIterator, slot: AdmissionSlot) -> AsyncIterator:
+    """
+    Passes a streamed response body through and releases the slot once it is sent or the client is gone
+    """
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        slot.release()
+
+
+class AdmissionController:
+    """
+    Per-user token bucket rate limit and in-flight limit. Requests over either limit are rejected with 429 and
+    Retry-After instead of queueing for DB connections. Not thread-safe, meant to be used from the event loop only.
+    """
+
+    def __init__(
+        self,
+        rate: float = ADMISSION_RATE,
+        burst: int = ADMISSION_BURST,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        max_users: int = 10_000,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_wait = max_wait
+        self.max_users = max_users
+        self.admitted = 0
+        self.rejected_rate = 0
+        self.rejected_in_flight = 0
+        self.queued = 0  # Admitted after waiting for an in-flight slot
+        self.queue_seconds_total = 0.0
+        self.queue_seconds_max = 0.0
+        self._users: OrderedDict[str, _UserState] = OrderedDict()
+
+    def _user_state(self, user_id: str) -> _UserState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(self.burst, self.max_in_flight)
+            # Evicted users start over with a full bucket. Their requests in flight release the old semaphore.
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def _take_token(self, state: _UserState) -> float:
+        """
+        Takes a token from the bucket. Returns 0 if there was one, otherwise seconds until there is.
+        """
+        now = time.monotonic()
+        state.tokens = min(self.burst, state.tokens + (now - state.refilled_at) * self.rate)
+        state.refilled_at = now
+        if state.tokens >= 1:
+            state.tokens -= 1
+            return 0.0
+        return (1 - state.tokens) / self.rate
+
+    async def acquire(self, user_id: str) -> AdmissionSlot:
+        """
+        Admits a request of the user or raises 429. Release the returned slot when the request is done.
+        """
+        state = self._user_state(user_id)
+        retry_after = self._take_token(state)
+        if retry_after:
+            self.rejected_rate += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+        if state.slots.locked():
+            start = time.perf_counter()
+            try:
+                if self.max_wait <= 0:
+                    raise TimeoutError
+                await asyncio.wait_for(state.slots.acquire(), timeout=self.max_wait)
+            except TimeoutError:
+                self.rejected_in_flight += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many concurrent requests",
+                    headers={"Retry-After": "1"},
+                )
+            waited = time.perf_counter() - start
+            self.queued += 1
+            self.queue_seconds_total += waited
+            self.queue_seconds_max = max(self.queue_seconds_max, waited)
+        else:
+            await state.slots.acquire()
+        self.admitted += 1
+        return AdmissionSlot(state.slots)
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "max_in_flight": self.max_in_flight,
+            "max_wait": self.max_wait,
+            "users": len(self._users),
+            "admitted": self.admitted,
+            "rejected_rate": self.rejected_rate,
+            "rejected_in_flight": self.rejected_in_flight,
+            "queued": self.queued,
+            "queue_seconds_total": self.queue_seconds_total,
+            "queue_seconds_max": self.queue_seconds_max,
+            "queue_seconds_avg": self.queue_seconds_total / self.queued if self.queued else 0.0,
+        }
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,155 @@
+from datetime import date
+import logging
+from typing import Literal
+
+import numpy as np
+from sqlalchemy import Select, case, distinct, func, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import Heatmap, MatchDB, SeasonAnalytics, SeasonStats, ShotEvent
+from user_cache import analytics_cache
+from xg import PITCH_LENGTH_M, PITCH_WIDTH_M, to_pitch_meters
+
+logger = logging.getLogger(__name__)
+
+
+def _filter_season(
+    statement: Select,
+    user_id: str,
+    from_date: date | None,
+    to_date: date | None,
+    team: str | None,
+) -> Select:
+    """
+    Restricts a query of shot events to the user's shots in the season analytics' date range and team filter
+    """
+    statement = statement.where(ShotEvent.user_id == user_id)
+    if from_date is not None:
+        statement = statement.where(ShotEvent.date >= from_date)
+    if to_date is not None:
+        statement = statement.where(ShotEvent.date <= to_date)
+    if team is not None:
+        statement = statement.join(MatchDB, MatchDB.match_id == ShotEvent.match_id).where(
+            or_(MatchDB.home_team == team, MatchDB.away_team == team)
+        )
+    return statement
+
+
+async def get_season_analytics(
+    user_id: str,
+    session: AsyncSession,
+    from_date: date | None = None,
+    to_date: date | None = None,
+    team: str | None = None,
+) -> SeasonAnalytics:
+    """
+    Totals of all shots in a date range, aggregated in Postgres from the shot events table.
+    team filters for matches where the team played at home or away.
+    """
+    cache_key = ("season", from_date, to_date, team)
+    cached = analytics_cache.get(user_id, cache_key)
+    if cached is not None:
+        return cached
+
+    logger.info(
+        "Calculating season analytics",
+        extra={"user_id": user_id, "from_date": from_date, "to_date": to_date, "team": team},
+    )
+    # Same split as getStatsFromActions, everything that isn't "team" counts for the opponent
+    side = case((ShotEvent.team == "team", "team"), else_="opponent").label("side")
+    # Counted over both sides at once, a match only the opponent shot in counts too
+    match_count = (
+        _filter_season(select(func.count(distinct(ShotEvent.match_id))), user_id, from_date, to_date, team)
+        .correlate(None)
+        .scalar_subquery()
+    )
+    statement = _filter_season(
+        select(
+            side,
+            match_count.label("matches"),
+            func.count().label("total_shots"),
+            func.count().filter(ShotEvent.shot_type == "on-target").label("on_target"),
+            func.count().filter(ShotEvent.shot_type == "blocked").label("blocked"),
+            func.count().filter(ShotEvent.shot_type == "off-target").label("off_target"),
+            func.count().filter(ShotEvent.assist_type == "assist").label("assists"),
+            func.count().filter(ShotEvent.assist_type == "dribble").label("dribbles"),
+            func.coalesce(func.sum(ShotEvent.xg), 0.0).label("xg"),
+        ),
+        user_id,
+        from_date,
+        to_date,
+        team,
+    ).group_by(side)
+    rows = (await session.execute(statement)).all()
+
+    stats = {"team": SeasonStats(), "opponent": SeasonStats()}
+    matches = 0
+    for row in rows:
+        values = dict(row._mapping)
+        matches = values.pop("matches")
+        side_stats = SeasonStats(**{key: value for key, value in values.items() if key != "side"})
+        if side_stats.total_shots:
+            side_stats.on_target_rate = side_stats.on_target / side_stats.total_shots
+        stats[row.side] = side_stats
+
+    analytics = SeasonAnalytics(from_date=from_date, to_date=to_date, team_filter=team, matches=matches, **stats)
+    analytics_cache.put(user_id, cache_key, analytics)
+    return analytics
+
+
+def _histogram(x: np.ndarray, y: np.ndarray, bins_x: int, bins_y: int) -> list[int]:
+    located = ~(np.isnan(x) | np.isnan(y))
+    # Shot event coordinates are normalized, i.e. pixels on a 1x1 pitch
+    pitch_x, pitch_y = to_pitch_meters(x[located], y[located], pitch_length_px=1, pitch_width_px=1)
+    counts, _, _ = np.histogram2d(
+        pitch_x,
+        pitch_y,
+        bins=(bins_x, bins_y),
+        range=((0, PITCH_LENGTH_M), (0, PITCH_WIDTH_M)),
+    )
+    return counts.astype(np.int64).ravel().tolist()
+
+
+async def get_heatmap(
+    user_id: str,
+    session: AsyncSession,
+    bins_x: int,
+    bins_y: int,
+    side: Literal["team", "opponent"] | None = None,
+    shot_type: str | None = None,
+    is_header: bool | None = None,
+) -> Heatmap:
+    """
+    Shot and assist location counts of all matches binned on a grid over the pitch in meters
+    """
+    cache_key = ("heatmap", bins_x, bins_y, side, shot_type, is_header)
+    cached = analytics_cache.get(user_id, cache_key)
+    if cached is not None:
+        return cached
+
+    logger.info("Calculating heatmap", extra={"user_id": user_id, "bins_x": bins_x, "bins_y": bins_y})
+    statement = select(ShotEvent.x, ShotEvent.y, ShotEvent.assist_x, ShotEvent.assist_y).where(
+        ShotEvent.user_id == user_id
+    )
+    if side == "team":
+        statement = statement.where(ShotEvent.team == "team")
+    if side == "opponent":
+        statement = statement.where(ShotEvent.team != "team")
+    if shot_type is not None:
+        statement = statement.where(ShotEvent.shot_type == shot_type)
+    if is_header is not None:
+        statement = statement.where(ShotEvent.is_header == is_header)
+    rows = (await session.execute(statement)).all()
+
+    # NULL assist coordinates become NaN and are left out of the assists histogram
+    coordinates = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    heatmap = Heatmap(
+        bins_x=bins_x,
+        bins_y=bins_y,
+        pitch_length_m=PITCH_LENGTH_M,
+        pitch_width_m=PITCH_WIDTH_M,
+        shots=_histogram(coordinates[:, 0], coordinates[:, 1], bins_x, bins_y),
+        assists=_histogram(coordinates[:, 2], coordinates[:, 3], bins_x, bins_y),
+    )
+    analytics_cache.put(user_id, cache_key, heatmap)
+    return heatmap
@@ -0,0 +1,84 @@
+from collections.abc import AsyncIterator
+import json
+import logging
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from coordinates import FRONTEND_PITCH, PitchSize
+from crud_operations import create_matches_in_db
+from models import BulkImportError, BulkImportResult, MatchCreate, MatchDB
+
+logger = logging.getLogger(__name__)
+
+BULK_INSERT_BATCH_SIZE = 100
+
+
+async def iter_records(request: Request) -> AsyncIterator[bytes | dict]:
+    """
+    Yields the records of a bulk import body. NDJSON bodies are read line by line as they stream in,
+    JSON array bodies (Content-Type: application/json) are parsed as a whole.
+    """
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            records = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body is not valid JSON")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of matches")
+        for record in records:
+            yield record
+        return
+
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    yield buffer
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(loc) for loc in err['loc']) or 'body'}: {err['msg']}" for err in error.errors())
+
+
+async def import_matches(
+    records: AsyncIterator[bytes | dict],
+    user_id: str,
+    session: AsyncSession,
+    pitch: PitchSize = FRONTEND_PITCH,
+) -> BulkImportResult:
+    """
+    Validates records one at a time and inserts the valid ones in batches. Invalid records are reported
+    per row and do not stop the import.
+    """
+    result = BulkImportResult(created=[], errors=[])
+    batch: list[MatchDB] = []
+    row = 0
+    async for record in records:
+        if isinstance(record, bytes):
+            if not record.strip():
+                continue  # Blank lines, e.g. the trailing newline of NDJSON
+            validate = MatchCreate.model_validate_json
+        else:
+            validate = MatchCreate.model_validate
+        row += 1
+        try:
+            match_data = validate(record)
+        except ValidationError as e:
+            result.errors.append(BulkImportError(row=row, error=_format_validation_error(e)))
+            continue
+
+        batch.append(MatchDB(**dict(match_data), user_id=user_id))
+        if len(batch) >= BULK_INSERT_BATCH_SIZE:
+            result.created.extend(await create_matches_in_db(batch, session, pitch))
+            batch = []
+
+    result.created.extend(await create_matches_in_db(batch, session, pitch))
+    logger.info(
+        "Bulk imported matches",
+        extra={"user_id": user_id, "matches": len(result.created), "failed_rows": len(result.errors)},
+    )
+    return result
@@ -0,0 +1,195 @@
+from typing import Literal, NamedTuple
+
+from models import MatchDB
+from xg import PITCH_LENGTH_PX, PITCH_WIDTH_PX
+
+# How MatchDB.periods is stored:
+# - pixels: actions as sent by the frontend, coordinates in pixels of the 800x500 pitch element. Matches stored
+#   before coordinates were normalized.
+# - normalized: actions with coordinates as 0..1 fractions of the pitch length (x) and width (y)
+# - columnar: normalized coordinates, each period's actions packed as one array per Action field and one of any
+#   other keys
+PeriodsFormat = Literal["pixels", "normalized", "columnar"]
+
+# Decimals kept in columnar storage. 1e-5 of the pitch length is about 1 mm.
+COLUMNAR_PRECISION = 5
+
+SHOT_TYPES = ["on-target", "blocked", "off-target"]
+ASSIST_TYPES = ["assist", "dribble"]
+
+
+class PitchSize(NamedTuple):
+    """
+    Size of the pitch the client's coordinates refer to
+    """
+    length: float
+    width: float
+
+
+FRONTEND_PITCH = PitchSize(PITCH_LENGTH_PX, PITCH_WIDTH_PX)
+NORMALIZED_PITCH = PitchSize(1.0, 1.0)
+
+
+def _scale_action(action: dict, x_factor: float, y_factor: float) -> dict:
+    scaled = {**action, "x": action["x"] * x_factor, "y": action["y"] * y_factor}
+    if action.get("assist"):
+        assist = action["assist"]
+        scaled["assist"] = {**assist, "x": assist["x"] * x_factor, "y": assist["y"] * y_factor}
+    return scaled
+
+
+def _scale_periods(periods: list[dict], x_factor: float, y_factor: float) -> list[dict]:
+    if x_factor == 1 and y_factor == 1:
+        return periods
+    return [
+        {**period, "actions": [_scale_action(action, x_factor, y_factor) for action in period.get("actions", [])]}
+        for period in periods
+    ]
+
+
+def normalize_action(action: dict, pitch: PitchSize) -> dict:
+    return _scale_action(action, 1 / pitch.length, 1 / pitch.width)
+
+
+def scale_action(action: dict, pitch: PitchSize) -> dict:
+    return _scale_action(action, pitch.length, pitch.width)
+
+
+def normalize_periods(periods: list[dict], pitch: PitchSize) -> list[dict]:
+    """
+    Converts coordinates on the client's pitch to 0..1 fractions of the pitch
+    """
+    return _scale_periods(periods, 1 / pitch.length, 1 / pitch.width)
+
+
+def scale_periods(periods: list[dict], pitch: PitchSize) -> list[dict]:
+    """
+    Converts normalized coordinates to coordinates on the client's pitch
+    """
+    return _scale_periods(periods, pitch.length, pitch.width)
+
+
+# Action keys packed into their own columns. Other keys, e.g. the xG the frontend adds, go to the extras column.
+PACKED_KEYS = {"type", "x", "y", "shot_type", "is_header", "team", "assist"}
+PACKED_ASSIST_KEYS = {"x", "y", "type"}
+
+
+def _code(values: list[str], value: str | None) -> int | None:
+    return values.index(value) if value in values else None
+
+
+def _packed_assist(action: dict) -> dict | None:
+    assist = action.get("assist")
+    if isinstance(assist, dict) and assist.keys() == PACKED_ASSIST_KEYS and assist["type"] in ASSIST_TYPES:
+        return assist
+    return None
+
+
+def _extras(action: dict, assist: dict | None) -> dict | None:
+    extras = {key: value for key, value in action.items() if key not in PACKED_KEYS}
+    if "assist" in action and assist is None:
+        extras["assist"] = action["assist"]  # null, or an assist with keys of its own
+    return extras or None
+
+
+def pack_periods(periods: list[dict]) -> list[dict]:
+    """
+    Packs each period's actions as one array per Action field. Keys that are not Action fields are kept in extras,
+    so unpack_periods returns the actions as they were stored.
+    """
+    packed = []
+    for period in periods:
+        actions = period.get("actions", [])
+        assists = [_packed_assist(action) for action in actions]
+        packed.append({
+            "type": period.get("type"),
+            "columns": {
+                "team": [action["team"] for action in actions],
+                "x": [round(action["x"], COLUMNAR_PRECISION) for action in actions],
+                "y": [round(action["y"], COLUMNAR_PRECISION) for action in actions],
+                "shot_type": [_code(SHOT_TYPES, action.get("shot_type")) for action in actions],
+                "is_header": [
+                    None if action.get("is_header") is None else int(action["is_header"]) for action in actions
+                ],
+                "assist_type": [_code(ASSIST_TYPES, assist["type"]) if assist else None for assist in assists],
+                "assist_x": [
+                    round(assist["x"], COLUMNAR_PRECISION) if assist else None for assist in assists
+                ],
+                "assist_y": [
+                    round(assist["y"], COLUMNAR_PRECISION) if assist else None for assist in assists
+                ],
+                "extras": [_extras(action, assist) for action, assist in zip(actions, assists)],
+            },
+        })
+    return packed
+
+
+def unpack_periods(periods: list[dict]) -> list[dict]:
+    """
+    Expands packed periods to the action dicts the normalized format stores. Fields an action did not have are left
+    out instead of set to None.
+    """
+    unpacked = []
+    for period in periods:
+        columns = period["columns"]
+        # Periods packed before extras were kept have no extras column
+        extras = columns.get("extras") or [None] * len(columns["x"])
+        actions = []
+        for i in range(len(columns["x"])):
+            action = {"type": "shot", "x": columns["x"][i], "y": columns["y"][i]}
+            if columns["shot_type"][i] is not None:
+                action["shot_type"] = SHOT_TYPES[columns["shot_type"][i]]
+            if columns["is_header"][i] is not None:
+                action["is_header"] = bool(columns["is_header"][i])
+            action["team"] = columns["team"][i]
+            if columns["assist_type"][i] is not None:
+                action["assist"] = {
+                    "x": columns["assist_x"][i],
+                    "y": columns["assist_y"][i],
+                    "type": ASSIST_TYPES[columns["assist_type"][i]],
+                }
+            if extras[i]:
+                action.update(extras[i])
+            actions.append(action)
+        unpacked.append({"type": period["type"], "actions": actions})
+    return unpacked
+
+
+def load_periods(periods: list[dict], periods_format: PeriodsFormat) -> list[dict]:
+    """
+    Stored periods as action dicts with normalized coordinates, whatever format they are stored in
+    """
+    if periods_format == "columnar":
+        return unpack_periods(periods)
+    if periods_format == "pixels":
+        return normalize_periods(periods, FRONTEND_PITCH)
+    return periods
+
+
+def store_periods(periods: list[dict], periods_format: PeriodsFormat) -> list[dict]:
+    """
+    Normalized periods in the format they are stored in
+    """
+    if periods_format == "columnar":
+        return pack_periods(periods)
+    if periods_format == "pixels":
+        return scale_periods(periods, FRONTEND_PITCH)
+    return periods
+
+
+def to_public_match(match: MatchDB, pitch: PitchSize) -> dict:
+    """
+    MatchPublic of the match as a plain dict built straight from the row, with periods expanded back to action dicts
+    with coordinates on the client's pitch. Stored data was validated on write so it is not validated again.
+    """
+    return {
+        "match_id": match.match_id,
+        "match_name": match.match_name,
+        "home_team": match.home_team,
+        "away_team": match.away_team,
+        "date": match.date,
+        "periods": scale_periods(load_periods(match.periods, match.periods_format), pitch),
+        "summary": match.summary,
+        "xg_model_version": match.xg_model_version,
+        "updated_at": match.updated_at,
+    }
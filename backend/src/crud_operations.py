@@ -1,76 +1,245 @@
+import base64
+from datetime import date, datetime
 import logging
+import os
+from dotenv import load_dotenv
 from sqlmodel.ext.asyncio.session import AsyncSession
-from models import MatchDB, MatchCreate, MatchPublic
-from sqlalchemy import select
+from models import MatchDB, MatchCreate, MatchListItem, MatchPage, MatchPublic, MatchSummary
+from sqlalchemy import String, any_, bindparam, delete, func, insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY
 from fastapi import HTTPException
 
+from coordinates import FRONTEND_PITCH, PitchSize, load_periods, normalize_periods, store_periods
+from shot_events import insert_shot_events, replace_shot_events
+from stats import get_match_summary
+from user_cache import analytics_cache
+from xg import XG_MODEL_VERSION
+
 logger = logging.getLogger(__name__)
 
+load_dotenv()
+# Format new writes store periods in: "normalized" or "columnar", see coordinates.PeriodsFormat
+PERIODS_STORAGE_FORMAT = os.environ.get("PERIODS_STORAGE_FORMAT", "normalized")
+
+# Fields a client may change with an update. match_id and user_id only identify the row.
+UPDATABLE_FIELDS = {"match_name", "home_team", "away_team", "date", "periods"}
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Most match ids one multi-get may ask for
+MAX_BATCH_SIZE = 100
+
+
+def encode_cursor(match_date: date, match_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{match_date.isoformat()}|{match_id}".encode()).decode()
+
+
+def prepare_periods(match: MatchDB, pitch: PitchSize) -> None:
+    """
+    Normalizes the client's coordinates, calculates the summary and converts periods to the storage format
+    """
+    periods = normalize_periods(match.periods, pitch)
+    match.summary = get_match_summary(periods).model_dump()
+    match.xg_model_version = XG_MODEL_VERSION
+    match.periods = store_periods(periods, PERIODS_STORAGE_FORMAT)
+    match.periods_format = PERIODS_STORAGE_FORMAT
+
+
+def decode_cursor(cursor: str) -> tuple[date, str]:
+    try:
+        match_date, match_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return date.fromisoformat(match_date), match_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 
 async def get_match_from_db(match_id: str, user_id: str, session: AsyncSession) -> MatchDB:
-    logger.info(f"User {user_id} fetching match {match_id}")
+    logger.info("Fetching match", extra={"user_id": user_id, "match_id": match_id})
     statement = select(MatchDB).where(MatchDB.user_id == user_id, MatchDB.match_id == match_id)
     result = await session.scalars(statement)
     match = result.first()
     if not match:
-        logger.info(f"User {user_id} tried to fetch non-existent match {match_id}")
+        logger.info("Match not found", extra={"user_id": user_id, "match_id": match_id})
         raise HTTPException(status_code=404, detail="Match not found")
-    logger.info(f"Found match: {match}")
+    logger.debug("Found match", extra={"match_id": match_id, "periods": len(match.periods)})
     return match
 
 
-async def list_matches_from_db(user_id: str, session: AsyncSession) -> list[MatchPublic]:
-    logger.info(f"User {user_id} listing matches")
-    statement = select(MatchDB).where(MatchDB.user_id == user_id)
-    result = await session.scalars(statement)
-    matches = result.all()
-    logger.info(f"User {user_id} found {len(matches)} matches")
-    logger.info(f"The first match on the list is: {matches[0]}")
-    return matches
+async def get_matches_from_db(match_ids: list[str], user_id: str, session: AsyncSession) -> list[MatchDB]:
+    """
+    The user's matches among match_ids in one query. Matches that do not exist or belong to someone else are left out.
+    """
+    logger.info("Fetching matches", extra={"user_id": user_id, "matches": len(match_ids)})
+    # One array parameter instead of IN (...), so the prepared statement is the same for any number of ids
+    statement = select(MatchDB).where(
+        MatchDB.user_id == user_id,
+        MatchDB.match_id == any_(bindparam("match_ids", match_ids, type_=ARRAY(String))),
+    )
+    return list((await session.scalars(statement)).all())
+
+
+async def get_match_updated_at_from_db(match_id: str, user_id: str, session: AsyncSession) -> datetime:
+    """
+    Reads only updated_at of a match, enough to answer conditional requests
+    """
+    statement = select(MatchDB.updated_at).where(MatchDB.user_id == user_id, MatchDB.match_id == match_id)
+    updated_at = (await session.execute(statement)).scalar_one_or_none()
+    if updated_at is None:
+        raise HTTPException(status_code=404, detail="Match not found")
+    return updated_at
+
+
+def _match_page_statement(user_id: str, limit: int, cursor: str | None, *columns):
+    statement = (
+        select(*columns)
+        .where(MatchDB.user_id == user_id)
+        .order_by(MatchDB.date.desc(), MatchDB.match_id.desc())
+        .limit(limit + 1)  # One extra row tells whether there is a next page
+    )
+    if cursor is not None:
+        statement = statement.where(tuple_(MatchDB.date, MatchDB.match_id) < tuple_(*decode_cursor(cursor)))
+    return statement
+
 
+async def get_match_page_versions_from_db(
+    user_id: str,
+    session: AsyncSession,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+) -> list[tuple[str, datetime]]:
+    """
+    (match_id, updated_at) of the matches on a page of list_matches_from_db, enough to answer conditional requests
+    """
+    statement = _match_page_statement(user_id, limit, cursor, MatchDB.match_id, MatchDB.updated_at)
+    return [tuple(row) for row in (await session.execute(statement)).all()]
 
-async def create_match_in_db(match_data: MatchCreate, session: AsyncSession) -> MatchDB:
-    logger.info(f"User {match_data.user_id} creating match {match_data.match_id}")
-    session.add(match_data)
-    await session.flush()
-    await session.refresh(match_data)
-    logger.info(f"Added match_data to session, returning: {match_data}")
-    return match_data
+
+async def get_match_summary_from_db(match_id: str, user_id: str, session: AsyncSession) -> MatchSummary:
+    logger.info("Fetching match summary", extra={"user_id": user_id, "match_id": match_id})
+    statement = select(MatchDB.summary).where(MatchDB.user_id == user_id, MatchDB.match_id == match_id)
+    result = await session.execute(statement)
+    row = result.first()
+    if not row:
+        logger.info("Match not found", extra={"user_id": user_id, "match_id": match_id})
+        raise HTTPException(status_code=404, detail="Match not found")
+    if row.summary is None:
+        # Matches stored before summaries existed. Calculated on the fly, stored on their next update.
+        match = await get_match_from_db(match_id, user_id, session)
+        return get_match_summary(load_periods(match.periods, match.periods_format))
+    return MatchSummary.model_validate(row.summary)
+
+
+async def list_matches_from_db(
+    user_id: str,
+    session: AsyncSession,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+) -> MatchPage:
+    """
+    Lists matches newest first, one page at a time. Pages are keyed on (date, match_id) of the last match
+    of the previous page so fetching any page is an index range scan. Periods are never loaded.
+    """
+    logger.info("Listing matches", extra={"user_id": user_id, "limit": limit})
+    statement = _match_page_statement(
+        user_id,
+        limit,
+        cursor,
+        MatchDB.match_id,
+        MatchDB.match_name,
+        MatchDB.home_team,
+        MatchDB.away_team,
+        MatchDB.date,
+        MatchDB.summary,
+        MatchDB.updated_at,
+    )
+    result = await session.execute(statement)
+    rows = result.all()
+
+    items = [MatchListItem.model_validate(row._mapping) for row in rows[:limit]]
+    next_cursor = encode_cursor(items[-1].date, items[-1].match_id) if len(rows) > limit else None
+    logger.info(
+        "Listed matches",
+        extra={"user_id": user_id, "matches": len(items), "more_pages": next_cursor is not None},
+    )
+    return MatchPage(items=items, next_cursor=next_cursor)
+
+
+async def create_match_in_db(
+    match_data: MatchCreate,
+    session: AsyncSession,
+    pitch: PitchSize = FRONTEND_PITCH,
+) -> MatchDB:
+    logger.info("Creating match", extra={"user_id": match_data.user_id, "match_id": match_data.match_id})
+    prepare_periods(match_data, pitch)
+    statement = insert(MatchDB).values(**match_data.model_dump(exclude={"updated_at"})).returning(MatchDB)
+    match = (await session.scalars(statement)).one()
+    await insert_shot_events([match], session)
+    analytics_cache.invalidate_on_commit(session, match.user_id)
+    logger.debug("Created match", extra={"match_id": match.match_id})
+    return match
+
+
+async def create_matches_in_db(
+    matches: list[MatchDB],
+    session: AsyncSession,
+    pitch: PitchSize = FRONTEND_PITCH,
+) -> list[str]:
+    """
+    Inserts many matches with one multi-row INSERT. Returns their match ids.
+    """
+    if not matches:
+        return []
+    logger.info("Creating matches", extra={"user_id": matches[0].user_id, "matches": len(matches)})
+    for match in matches:
+        prepare_periods(match, pitch)
+    await session.execute(insert(MatchDB).values([match.model_dump(exclude={"updated_at"}) for match in matches]))
+    await insert_shot_events(matches, session)
+    analytics_cache.invalidate_on_commit(session, matches[0].user_id)
+    return [match.match_id for match in matches]
 
 
 async def update_match_in_db(
     match_id: str,
     match_data: MatchPublic,
-    session: AsyncSession
+    session: AsyncSession,
+    pitch: PitchSize = FRONTEND_PITCH,
 ) -> MatchDB:
-    logger.info(f"User {match_data.user_id} updating match {match_id}")
-    statement = select(MatchDB).where(MatchDB.user_id == match_data.user_id, MatchDB.match_id == match_id)
+    logger.info("Updating match", extra={"user_id": match_data.user_id, "match_id": match_id})
+    prepare_periods(match_data, pitch)
+    statement = (
+        update(MatchDB)
+        .where(MatchDB.user_id == match_data.user_id, MatchDB.match_id == match_id)
+        .values(
+            **match_data.model_dump(include=UPDATABLE_FIELDS),
+            summary=match_data.summary,
+            periods_format=match_data.periods_format,
+            xg_model_version=match_data.xg_model_version,
+            updated_at=func.now(),
+        )
+        .returning(MatchDB)
+    )
     result = await session.scalars(statement)
-    existing_match = result.first()
-    if not existing_match:
-        logger.info(f"User {match_data.user_id} tried to update non-existent match {match_id}")
+    updated_match = result.first()
+    if not updated_match:
+        logger.info("Match not found", extra={"user_id": match_data.user_id, "match_id": match_id})
         raise HTTPException(status_code=404, detail="Match not found")
 
-    existing_match.match_name = match_data.match_name
-    existing_match.home_team = match_data.home_team
-    existing_match.away_team = match_data.away_team
-    existing_match.date = match_data.date
-    existing_match.periods = match_data.periods
-
-    session.add(existing_match)
-    await session.flush()
-    await session.refresh(existing_match)
-    logger.info(f"Added updated existing_data to session, returning: {existing_match}")
-    return existing_match
+    await replace_shot_events(updated_match, session)
+    analytics_cache.invalidate_on_commit(session, updated_match.user_id)
+    logger.debug("Updated match", extra={"match_id": match_id})
+    return updated_match
 
 
 async def delete_match_from_db(match_id: str, user_id: str, session: AsyncSession) -> None:
-    logger.info(f"User {user_id} deleting match {match_id}")
-    statement = select(MatchDB).where(MatchDB.user_id == user_id, MatchDB.match_id == match_id)
-    result = await session.scalars(statement)
-    match = result.first()
-    if not match:
-        logger.info(f"User {user_id} tried to delete non-existent match {match_id}")
+    logger.info("Deleting match", extra={"user_id": user_id, "match_id": match_id})
+    # Shot events of the match are removed by the ON DELETE CASCADE of their foreign key
+    statement = (
+        delete(MatchDB)
+        .where(MatchDB.user_id == user_id, MatchDB.match_id == match_id)
+        .returning(MatchDB.match_id)
+    )
+    result = await session.execute(statement)
+    if result.first() is None:
+        logger.info("Match not found", extra={"user_id": user_id, "match_id": match_id})
         raise HTTPException(status_code=404, detail="Match not found")
-
-    await session.delete(match)
+    analytics_cache.invalidate_on_commit(session, user_id)
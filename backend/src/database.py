@@ -5,38 +5,125 @@ import ssl
 import logging
 
 from dotenv import load_dotenv
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlmodel import SQLModel
+
+from pool_metrics import InstrumentedPool, ReadInstrumentedPool, pool_metrics, read_pool_metrics
+from request_metrics import request_metrics
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-DATABASE_URL = os.environ["DATABASE_URL"]
-ssl_context = ssl.create_default_context()
+# Pool settings. Serverless Postgres closes idle connections, hence pre-ping and a short recycle time.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "300"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+# Set to 0 when connecting through a transaction-mode pooler such as PgBouncer
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "100"))
+# Only turn off for a local database, e.g. when running benchmarks
+DB_SSL = os.environ.get("DB_SSL", "true").lower() == "true"
+
+# Version of the newest migration in backend/migrations the code relies on
+SCHEMA_VERSION = 8
+
+_engine: AsyncEngine | None = None
+_read_engine: AsyncEngine | None = None
+_async_session: async_sessionmaker[AsyncSession] | None = None
+_read_async_session: async_sessionmaker[AsyncSession] | None = None
+
+
+def _create_engine(url: str, **kwargs) -> AsyncEngine:
+    engine = create_async_engine(
+        url,
+        connect_args={
+            "ssl": ssl.create_default_context() if DB_SSL else False,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        },
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        **kwargs,
+    )
+    request_metrics.attach(engine)
+    return engine
+
+
+def get_engine() -> AsyncEngine:
+    """
+    Engine of DATABASE_URL, created on first use so that importing this module does not need the database
+    """
+    global _engine
+    if _engine is None:
+        _engine = _create_engine(os.environ["DATABASE_URL"], poolclass=InstrumentedPool)
+        pool_metrics.attach(_engine)
+    return _engine
+
+
+def get_read_engine() -> AsyncEngine:
+    """
+    Engine of the read replica in DATABASE_READ_URL, or the primary engine when no replica is configured
+    """
+    global _read_engine
+    if _read_engine is None:
+        read_url = os.environ.get("DATABASE_READ_URL")
+        if read_url:
+            _read_engine = _create_engine(read_url, poolclass=ReadInstrumentedPool)
+            read_pool_metrics.attach(_read_engine)
+        else:
+            _read_engine = get_engine()
+    return _read_engine
+
 
-engine = create_async_engine(
-    DATABASE_URL,
-    connect_args={"ssl": ssl_context},
-)
+def get_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    global _async_session
+    if _async_session is None:
+        _async_session = async_sessionmaker(
+            get_engine(),
+            class_=AsyncSession,
+            expire_on_commit=False,
+        )
+    return _async_session
 
-async_session = async_sessionmaker(
-    engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
 
-async def init_db():
-    logger.info("Running init_db")
-    async with engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
-    logger.info("init_db complete")
+def get_read_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    global _read_async_session
+    if _read_async_session is None:
+        _read_async_session = async_sessionmaker(
+            get_read_engine(),
+            class_=AsyncSession,
+            expire_on_commit=False,
+        )
+    return _read_async_session
+
+
+async def check_schema_version() -> None:
+    """
+    Raises error unless the migrations the code relies on were applied (see migrate.py). One query, run at startup.
+    """
+    async with get_engine().connect() as conn:
+        try:
+            version = await conn.scalar(text("SELECT max(version) FROM schema_version"))
+        except ProgrammingError:
+            version = None
+    if version is None or version < SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema is at version {version}, version {SCHEMA_VERSION} is required. "
+            "Run `python src/migrate.py`."
+        )
+    logger.info("Database schema is up to date", extra={"version": version})
 
 
 @asynccontextmanager
 async def get_session_context() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session() as session:
+    async with get_sessionmaker()() as session:
         try:
             yield session
             await session.commit()
@@ -46,3 +133,18 @@ async def get_session_context() -> AsyncGenerator[AsyncSession, None]:
             raise
         finally:
             logger.debug("Session closed")
+
+
+@asynccontextmanager
+async def get_read_session_context() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Session for handlers that only read. Runs on the read replica if there is one, in a READ ONLY transaction that
+    is rolled back when the connection returns to the pool instead of committed.
+    """
+    async with get_read_sessionmaker()() as session:
+        # asyncpg starts the transaction as BEGIN READ ONLY, no separate SET TRANSACTION round trip
+        await session.connection(execution_options={"postgresql_readonly": True})
+        try:
+            yield session
+        finally:
+            logger.debug("Read-only session closed")
@@ -0,0 +1,38 @@
+from datetime import datetime
+import hashlib
+
+
+def _etag(*parts) -> str:
+    return '"' + hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()[:32] + '"'
+
+
+def match_etag(match_id: str, updated_at: datetime, *variant) -> str:
+    """
+    variant holds request parameters that change the representation, e.g. the client's pitch size
+    """
+    return _etag(match_id, updated_at.isoformat(), *variant)
+
+
+def match_list_etag(page_versions: list[tuple[str, datetime]], limit: int, cursor: str | None) -> str:
+    """
+    page_versions holds (match_id, updated_at) of every match on the page. Any write to a match on the page, or a
+    match entering or leaving it, changes them. updated_at is the start time of the writing transaction, so the
+    latest updated_at of the user alone misses writes that commit out of order.
+    """
+    versions = (f"{match_id}@{updated_at.isoformat()}" for match_id, updated_at in page_versions)
+    return _etag(*versions, limit, cursor or "")
+
+
+def xg_grid_etag(bins_x: int, bins_y: int, is_header: bool, model_version: int) -> str:
+    return _etag("xg-grid", bins_x, bins_y, is_header, model_version)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    If-None-Match uses weak comparison, so W/ prefixes are ignored
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
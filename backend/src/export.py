@@ -0,0 +1,92 @@
+from collections.abc import AsyncIterator
+import csv
+import io
+import logging
+from typing import Literal
+
+import orjson
+from sqlalchemy import select
+
+from coordinates import FRONTEND_PITCH, PitchSize, to_public_match
+from database import get_read_session_context
+from models import MatchDB
+from xg import extract_shots
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 100
+
+CSV_COLUMNS = [
+    "match_id",
+    "period",
+    "team",
+    "x",
+    "y",
+    "shot_type",
+    "is_header",
+    "assist_type",
+    "assist_x",
+    "assist_y",
+]
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _csv_line(values: list) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+def _match_to_csv(match: dict) -> str:
+    """
+    One row per shot of the match
+    """
+    lines = []
+    for period, _, action in extract_shots(match["periods"]):
+        assist = action.get("assist") or {}
+        lines.append(_csv_line([
+            match["match_id"],
+            period,
+            action.get("team"),
+            action.get("x"),
+            action.get("y"),
+            action.get("shot_type"),
+            action.get("is_header", False),
+            assist.get("type"),
+            assist.get("x"),
+            assist.get("y"),
+        ]))
+    return "".join(lines)
+
+
+async def export_matches(
+    user_id: str,
+    export_format: Literal["ndjson", "csv"],
+    pitch: PitchSize = FRONTEND_PITCH,
+) -> AsyncIterator[str]:
+    """
+    Streams all matches of a user through a server-side cursor, so only one batch of matches is in memory at a time.
+    """
+    logger.info("Exporting matches", extra={"user_id": user_id, "format": export_format})
+    if export_format == "csv":
+        yield _csv_line(CSV_COLUMNS)
+
+    statement = (
+        select(MatchDB)
+        .where(MatchDB.user_id == user_id)
+        .order_by(MatchDB.date, MatchDB.match_id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    async with get_read_session_context() as session:
+        result = await session.stream_scalars(statement)
+        async for match in result:
+            public_match = to_public_match(match, pitch)
+            if export_format == "csv":
+                yield _match_to_csv(public_match)
+            else:
+                yield orjson.dumps(public_match).decode() + "\n"
+            session.expunge(match)
@@ -0,0 +1,170 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+import logging
+import os
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from coordinates import PitchSize, normalize_action
+from database import get_session_context
+from models import LiveActionEvent
+from period_actions import append_actions_in_db
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Buffered actions of a match are written at least this often
+LIVE_FLUSH_INTERVAL = float(os.environ.get("LIVE_FLUSH_INTERVAL", "2"))
+# and as soon as this many are buffered
+LIVE_FLUSH_MAX_ACTIONS = int(os.environ.get("LIVE_FLUSH_MAX_ACTIONS", "20"))
+# Failed writes in a row after which the buffered actions are dropped and the connections told so
+LIVE_FLUSH_MAX_RETRIES = int(os.environ.get("LIVE_FLUSH_MAX_RETRIES", "3"))
+
+Notify = Callable[[dict], Awaitable[None]]
+
+
+class LiveMatchBuffer:
+    """
+    Actions received over the live WebSockets of one match, written to the DB in coalesced batches by a
+    background task. Shared by all live connections of the match in this process.
+    """
+
+    def __init__(self, match_id: str, user_id: str):
+        self.match_id = match_id
+        self.user_id = user_id
+        self.connections = 0
+        # (period, normalized action, notify callback of the connection, seq within the connection)
+        self.pending: list[tuple[str, dict, Notify, int]] = []
+        self.failed_flushes = 0
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._flush_periodically())
+
+    def add(self, period: str, action: dict, notify: Notify, seq: int) -> None:
+        self.pending.append((period, action, notify, seq))
+        if len(self.pending) >= LIVE_FLUSH_MAX_ACTIONS:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        """
+        Writes all buffered actions in one transaction and tells each connection which of its actions were stored.
+        Actions stay buffered for the next flush if the write fails, unless the match no longer exists or the write
+        failed LIVE_FLUSH_MAX_RETRIES times in a row. Dropped actions are reported to their connections by seq.
+        """
+        async with self._flush_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, []
+            try:
+                async with get_session_context() as session:
+                    match, indexes = await append_actions_in_db(
+                        self.match_id, self.user_id, [(period, action) for period, action, _, _ in batch], session
+                    )
+            except HTTPException as e:
+                logger.warning("Dropped live actions", extra={"match_id": self.match_id, "actions": len(batch)})
+                await self._notify_dropped(batch, e.detail)
+                return
+            except Exception:
+                self.failed_flushes += 1
+                logger.exception(
+                    "Writing live actions failed", extra={"match_id": self.match_id, "attempt": self.failed_flushes}
+                )
+                if self.failed_flushes < LIVE_FLUSH_MAX_RETRIES:
+                    self.pending = batch + self.pending
+                    return
+                logger.error("Dropped live actions", extra={"match_id": self.match_id, "actions": len(batch)})
+                self.failed_flushes = 0
+                await self._notify_dropped(batch, "Actions could not be stored")
+                return
+            self.failed_flushes = 0
+
+            stored: dict[Notify, list[dict]] = {}
+            for (period, _, notify, seq), index in zip(batch, indexes):
+                stored.setdefault(notify, []).append({"seq": seq, "period": period, "action_index": index})
+            for notify, actions in stored.items():
+                await notify({"type": "stored", "actions": actions, "summary": match.summary})
+
+    async def _notify_dropped(self, batch: list[tuple[str, dict, Notify, int]], detail: str) -> None:
+        dropped: dict[Notify, list[int]] = {}
+        for _, _, notify, seq in batch:
+            dropped.setdefault(notify, []).append(seq)
+        for notify, seqs in dropped.items():
+            await notify({"type": "error", "detail": detail, "seqs": seqs})
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=LIVE_FLUSH_INTERVAL)
+            except TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def close(self) -> None:
+        # Cancelled under the lock, so a flush in progress is not interrupted and rolled back
+        async with self._flush_lock:
+            self._task.cancel()
+        await self.flush()
+        if self.pending:
+            logger.error("Lost live actions", extra={"match_id": self.match_id, "actions": len(self.pending)})
+
+
+# (user_id, match_id) -> buffer of the match's open live connections
+live_buffers: dict[tuple[str, str], LiveMatchBuffer] = {}
+
+
+async def flush_all_live_buffers() -> None:
+    """
+    Writes the buffered actions of all matches, called on shutdown
+    """
+    for buffer in list(live_buffers.values()):
+        await buffer.flush()
+
+
+async def run_live_session(websocket: WebSocket, match_id: str, user_id: str, pitch: PitchSize) -> None:
+    """
+    Receives LiveActionEvent messages on an accepted WebSocket until the client disconnects. Each event is
+    acknowledged with its seq as soon as it is buffered, and reported again with its action index once stored.
+    """
+    key = (user_id, match_id)
+    buffer = live_buffers.get(key)
+    if buffer is None:
+        buffer = live_buffers[key] = LiveMatchBuffer(match_id, user_id)
+    buffer.connections += 1
+    logger.info("Live session started", extra={"user_id": user_id, "match_id": match_id})
+
+    async def notify(message: dict) -> None:
+        try:
+            await websocket.send_json(message)
+        except Exception:
+            pass  # Connection is gone, the actions are stored anyway
+
+    seq = 0
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                event = LiveActionEvent.model_validate_json(message)
+            except ValidationError as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                continue
+            seq += 1
+            buffer.add(event.period, normalize_action(event.action.model_dump(exclude_unset=True), pitch), notify, seq)
+            await websocket.send_json({"type": "ack", "seq": seq})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        logger.info("Live session ended", extra={"user_id": user_id, "match_id": match_id, "actions": seq})
+        # Shielded, so the buffered actions are written even if the server cancels the connection's task
+        await asyncio.shield(_release_buffer(key, buffer))
+
+
+async def _release_buffer(key: tuple[str, str], buffer: LiveMatchBuffer) -> None:
+    buffer.connections -= 1
+    if buffer.connections == 0:
+        live_buffers.pop(key, None)
+        await buffer.close()
+    else:
+        await buffer.flush()
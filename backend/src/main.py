@@ -1,47 +1,155 @@
+from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
+from datetime import date
+import hmac
 import logging
 import os
+import time
+from typing import Literal
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, Body, FastAPI, HTTPException, Depends, Path, Response, Security, status
+from fastapi import (
+    APIRouter,
+    Body,
+    FastAPI,
+    HTTPException,
+    Depends,
+    Header,
+    Path,
+    Query,
+    Request,
+    Response,
+    Security,
+    WebSocket,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.background import BackgroundTask
 from jose import jwt
 
+from admission import admission_controller, release_after
+from analytics import get_heatmap, get_season_analytics
+from coordinates import NORMALIZED_PITCH, PitchSize, load_periods, to_public_match
+from bulk_import import import_matches, iter_records
 from crud_operations import (
+    DEFAULT_PAGE_SIZE,
+    MAX_BATCH_SIZE,
+    MAX_PAGE_SIZE,
     get_match_from_db,
+    get_matches_from_db,
+    get_match_summary_from_db,
+    get_match_updated_at_from_db,
+    get_match_page_versions_from_db,
     list_matches_from_db,
     create_match_in_db,
     update_match_in_db,
     delete_match_from_db
 )
-from database import get_session_context, init_db
-from models import MatchBase, MatchDB, MatchCreate, MatchPublic
+from database import (
+    check_schema_version,
+    get_engine,
+    get_read_engine,
+    get_read_session_context,
+    get_session_context,
+)
+from etags import etag_matches, match_etag, match_list_etag, xg_grid_etag
+from export import MEDIA_TYPES, export_matches
+from live_sessions import flush_all_live_buffers, run_live_session
+from models import (
+    ActionPatch,
+    ActionPatchResult,
+    BulkImportResult,
+    Heatmap,
+    MatchBatch,
+    MatchDB,
+    MatchCreate,
+    MatchPage,
+    MatchPublic,
+    MatchSummary,
+    MatchXG,
+    PeriodType,
+    SeasonAnalytics,
+    ShotXG,
+    XGGrid,
+    XGRecomputeStatus,
+)
+from period_actions import append_action_in_db, remove_action_from_db
+from pool_metrics import pool_metrics, read_pool_metrics
+from request_metrics import RequestTimings, current_timings, request_metrics, server_timing_header
+from structured_logging import configure_logging
+from token_cache import TokenCache
+from xg import PITCH_LENGTH_PX, PITCH_WIDTH_PX, XG_MODEL_VERSION, XG_MODELS, calculate_match_xg
+from xg_grid import XG_GRID_RESOLUTIONS, xg_grid_json
+from xg_recompute import xg_recompute_job
 
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
+configure_logging()
 
 load_dotenv()
 SUPABASE_JWT_SECRET = os.environ["SUPABASE_JWT_SECRET"]
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "1024"))
+# Users (JWT sub) allowed to use the /internal endpoints
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+# Static bearer token a Prometheus scraper may use for /metrics instead of an admin JWT
+METRICS_SCRAPE_TOKEN = os.environ.get("METRICS_SCRAPE_TOKEN", "")
+# Adds a Server-Timing header with handler, JWT and SQL time to every response
+SERVER_TIMING_HEADER = os.environ.get("SERVER_TIMING_HEADER", "false").lower() == "true"
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
+    await check_schema_version()
     yield
+    await flush_all_live_buffers()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 security = HTTPBearer()
+token_cache = TokenCache(max_size=TOKEN_CACHE_SIZE)
+
+
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    """
+    Records handler latency, JWT verification time and SQL statements of the request in per-route histograms
+    """
+    timings = RequestTimings()
+    current_timings.set(timings)
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    # Path template, so that /matches/{match_id} is one route. Unmatched paths are grouped together.
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    request_metrics.observe(request.method, route, response.status_code, elapsed, timings)
+    if SERVER_TIMING_HEADER:
+        response.headers["Server-Timing"] = server_timing_header(elapsed, timings)
+    return response
 
 
 async def verify_token(authorization: HTTPAuthorizationCredentials = Security(security)) -> dict[str, str]:
     """
     Raises error for invalid/missing tokens. Returns decoded JWT payload if successful.
+    Verified payloads are cached until the token expires.
     """
+    start = time.perf_counter()
+    try:
+        return _decode_token(authorization.credentials)
+    finally:
+        timings = current_timings.get()
+        if timings is not None:
+            timings.jwt_seconds += time.perf_counter() - start
+
+
+def _decode_token(token: str) -> dict[str, str]:
+    cached_payload = token_cache.get(token)
+    if cached_payload is not None:
+        return cached_payload
     try:
-        token = authorization.credentials
         payload = jwt.decode(token, SUPABASE_JWT_SECRET, algorithms=["HS256"])
+        token_cache.put(token, payload)
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
@@ -51,6 +159,37 @@ async def verify_token(authorization: HTTPAuthorizationCredentials = Security(se
         raise HTTPException(status_code=401, detail=str(e))
 
 
+async def verify_admin(payload: dict = Depends(verify_token)) -> dict[str, str]:
+    """
+    Raises error unless the token belongs to an admin. Returns decoded JWT payload if successful.
+    """
+    if payload["sub"] not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload
+
+
+async def verify_metrics_access(
+    authorization: HTTPAuthorizationCredentials = Security(security),
+) -> None:
+    """
+    Raises error unless the bearer token is METRICS_SCRAPE_TOKEN or an admin's JWT
+    """
+    if METRICS_SCRAPE_TOKEN and hmac.compare_digest(authorization.credentials, METRICS_SCRAPE_TOKEN):
+        return
+    await verify_admin(await verify_token(authorization))
+
+
+async def admit_user(payload: dict = Depends(verify_token)) -> AsyncGenerator[dict[str, str], None]:
+    """
+    verify_token plus the per-user rate and concurrency limits of admission.py. Raises 429 when over a limit.
+    """
+    slot = await admission_controller.acquire(payload["sub"])
+    try:
+        yield payload
+    finally:
+        slot.release()
+
+
 @app.get("/")
 async def welcome_message():
     return "Welcome to Football Analysis Tool backend service. Try '/docs' for more info."
@@ -65,58 +204,232 @@ async def hello(payload: dict = Depends(verify_token)):
     }
 
 
+def client_pitch(
+    coordinates: Literal["pixels", "normalized"] = Query(
+        "pixels", description="normalized means 0..1 fractions of the pitch length (x) and width (y)"
+    ),
+    pitch_length_px: float = Query(PITCH_LENGTH_PX, gt=0, description="Width of the pitch element in pixels"),
+    pitch_width_px: float = Query(PITCH_WIDTH_PX, gt=0, description="Height of the pitch element in pixels"),
+) -> PitchSize:
+    """
+    Pitch the coordinates of sent and returned actions refer to
+    """
+    if coordinates == "normalized":
+        return NORMALIZED_PITCH
+    return PitchSize(pitch_length_px, pitch_width_px)
+
+
 matches_router = APIRouter(prefix="/matches")
 
 
+@matches_router.get("/export")
+async def export_all_matches(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    pitch: PitchSize = Depends(client_pitch),
+    payload: dict = Depends(verify_token),
+) -> StreamingResponse:
+    """
+    Export all matches of the authenticated user. ndjson has one MatchPublic per line, csv has one row per shot.
+    """
+    # Not admit_user: dependencies exit before the body is streamed, the slot is held until the export is sent
+    slot = await admission_controller.acquire(payload["sub"])
+    return StreamingResponse(
+        release_after(export_matches(user_id=payload["sub"], export_format=export_format, pitch=pitch), slot),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="matches.{export_format}"'},
+        background=BackgroundTask(slot.release),  # In case the body is never iterated
+    )
+
+
+@matches_router.get("/batch", response_model=MatchBatch)
+async def get_matches_batch(
+    ids: str = Query(..., description=f"Comma-separated match ids, at most {MAX_BATCH_SIZE}"),
+    pitch: PitchSize = Depends(client_pitch),
+    payload: dict = Depends(admit_user),
+) -> MatchBatch:
+    """Get many matches with one query, e.g. for comparisons. Ids that are not found are listed in missing."""
+    match_ids = list(dict.fromkeys(match_id.strip() for match_id in ids.split(",") if match_id.strip()))
+    if not match_ids:
+        raise HTTPException(status_code=400, detail="No match ids given")
+    if len(match_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_SIZE} match ids can be fetched at once")
+    async with get_read_session_context() as session:
+        matches = await get_matches_from_db(match_ids, user_id=payload["sub"], session=session)
+    found = {match.match_id: to_public_match(match, pitch) for match in matches}
+    return ORJSONResponse({
+        "matches": {match_id: found[match_id] for match_id in match_ids if match_id in found},
+        "missing": [match_id for match_id in match_ids if match_id not in found],
+    })
+
+
 @matches_router.get("/{match_id}", response_model=MatchPublic)
 async def get_match(
     match_id: str = Path(...),
-    payload: dict = Depends(verify_token),
-) -> MatchBase:
-    async with get_session_context() as session:
+    if_none_match: str | None = Header(None),
+    pitch: PitchSize = Depends(client_pitch),
+    payload: dict = Depends(admit_user),
+) -> MatchPublic:
+    """Get a match. Responds 304 Not Modified if the ETag in If-None-Match is still current"""
+    async with get_read_session_context() as session:
+        if if_none_match:
+            updated_at = await get_match_updated_at_from_db(match_id, user_id=payload["sub"], session=session)
+            etag = match_etag(match_id, updated_at, pitch)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
         match = await get_match_from_db(match_id, user_id=payload["sub"], session=session)
-        return match
+        return ORJSONResponse(
+            to_public_match(match, pitch),
+            headers={"ETag": match_etag(match_id, match.updated_at, pitch)},
+        )
 
 
-@matches_router.get("/", response_model=list[MatchPublic])
+@matches_router.get("/{match_id}/xg", response_model=MatchXG)
+async def get_match_xg(
+    match_id: str = Path(...),
+    model_version: int = Query(XG_MODEL_VERSION, description="xG model version, defaults to the current one"),
+    payload: dict = Depends(admit_user),
+) -> MatchXG:
+    """Calculate xG for every shot of a match"""
+    if model_version not in XG_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown xG model version {model_version}")
+    async with get_read_session_context() as session:
+        match = await get_match_from_db(match_id, user_id=payload["sub"], session=session)
+
+    shots, xg = calculate_match_xg(load_periods(match.periods, match.periods_format), model_version)
+    team_totals: dict[str, float] = {}
+    for (_, _, action), shot_xg in zip(shots, xg.tolist()):
+        team_totals[action["team"]] = team_totals.get(action["team"], 0.0) + shot_xg
+    return MatchXG(
+        match_id=match_id,
+        model_version=model_version,
+        shots=[
+            ShotXG(period=period, index=index, team=action["team"], xg=shot_xg)
+            for (period, index, action), shot_xg in zip(shots, xg.tolist())
+        ],
+        team_totals=team_totals,
+    )
+
+
+@matches_router.get("/{match_id}/summary", response_model=MatchSummary)
+async def get_match_summary(
+    match_id: str = Path(...),
+    payload: dict = Depends(admit_user),
+) -> MatchSummary:
+    """Get shot, assist, dribble and xG totals of a match without its periods"""
+    async with get_read_session_context() as session:
+        return await get_match_summary_from_db(match_id, user_id=payload["sub"], session=session)
+
+
+@matches_router.get("/", response_model=MatchPage)
 async def list_matches(
-    payload: dict = Depends(verify_token),
-)-> list[MatchBase]:
-    """List all matches for the authenticated user"""
-    async with get_session_context() as session:
-        matches = await list_matches_from_db(user_id=payload["sub"], session=session)
-        return matches
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = Query(None),
+    if_none_match: str | None = Header(None),
+    payload: dict = Depends(admit_user),
+) -> MatchPage:
+    """
+    List matches of the authenticated user without periods, newest first. Use next_cursor to get the next page.
+    Responds 304 Not Modified if the ETag in If-None-Match is still current.
+    """
+    async with get_read_session_context() as session:
+        page_versions = await get_match_page_versions_from_db(
+            user_id=payload["sub"], session=session, limit=limit, cursor=cursor
+        )
+        etag = match_list_etag(page_versions, limit, cursor)
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        page = await list_matches_from_db(user_id=payload["sub"], session=session, limit=limit, cursor=cursor)
+        return Response(page.model_dump_json(), media_type="application/json", headers={"ETag": etag})
 
 
 @matches_router.post("/", response_model=MatchPublic, status_code=201)
 async def create_match(
     match_data: MatchCreate = Body(...),
-    payload: dict = Depends(verify_token),
+    pitch: PitchSize = Depends(client_pitch),
+    payload: dict = Depends(admit_user),
 ) -> MatchPublic:
     """Create a new match for the authenticated user"""
-    match_db = MatchDB(**match_data.model_dump(), user_id=payload["sub"])
+    match_db = MatchDB(**dict(match_data), user_id=payload["sub"])
     async with get_session_context() as session:
-        match = await create_match_in_db(match_db, session=session)
-        return match
+        match = await create_match_in_db(match_db, session=session, pitch=pitch)
+        return ORJSONResponse(to_public_match(match, pitch), status_code=201)
+
+
+@matches_router.post("/bulk", response_model=BulkImportResult, status_code=201)
+async def create_matches_bulk(
+    request: Request,
+    pitch: PitchSize = Depends(client_pitch),
+    payload: dict = Depends(admit_user),
+) -> BulkImportResult:
+    """
+    Create many matches at once. Body is NDJSON (one MatchCreate per line) or a JSON array of MatchCreate objects.
+    Invalid rows are reported in errors, all valid rows are created in one transaction.
+    """
+    async with get_session_context() as session:
+        return await import_matches(iter_records(request), user_id=payload["sub"], pitch=pitch, session=session)
 
 
 @matches_router.put("/{match_id}", response_model=MatchPublic)
 async def update_match(
     match_id: str = Path(...),
     match_data: MatchPublic = Body(...),
-    payload: dict = Depends(verify_token),
+    pitch: PitchSize = Depends(client_pitch),
+    payload: dict = Depends(admit_user),
 ) -> MatchPublic:
     """Update an existing match"""
-    match_db = MatchDB(**match_data.model_dump(), user_id=payload["sub"])
+    match_db = MatchDB(**dict(match_data), user_id=payload["sub"])
     async with get_session_context() as session:
-        updated_match = await update_match_in_db(match_id, match_db, session=session)
-        return updated_match
+        updated_match = await update_match_in_db(match_id, match_db, session=session, pitch=pitch)
+        return ORJSONResponse(to_public_match(updated_match, pitch))
+
+
+@matches_router.patch("/{match_id}/periods/{period}/actions", response_model=ActionPatchResult)
+async def patch_period_actions(
+    match_id: str = Path(...),
+    period: PeriodType = Path(...),
+    patch: ActionPatch = Body(...),
+    pitch: PitchSize = Depends(client_pitch),
+    payload: dict = Depends(admit_user),
+) -> ActionPatchResult:
+    """
+    Append or remove a single action of a period without sending the whole match. Meant for live tagging.
+    Appending to a period the match does not have yet adds the period.
+    """
+    async with get_session_context() as session:
+        if patch.op == "append":
+            return await append_action_in_db(
+                match_id, payload["sub"], period, patch.action, session=session, pitch=pitch
+            )
+        return await remove_action_from_db(match_id, payload["sub"], period, patch.index, session=session)
+
+
+@matches_router.websocket("/{match_id}/live")
+async def live_match(
+    websocket: WebSocket,
+    match_id: str = Path(...),
+    token: str | None = Query(None, description="JWT, for clients that cannot set the Authorization header"),
+    pitch: PitchSize = Depends(client_pitch),
+):
+    """
+    Live tagging of a match. The token is verified once when connecting. Send one LiveActionEvent per message,
+    each is acknowledged right away and appended to the match in batches, see live_sessions.
+    """
+    credentials = token or websocket.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    try:
+        payload = _decode_token(credentials)
+        async with get_read_session_context() as session:
+            await get_match_updated_at_from_db(match_id, user_id=payload["sub"], session=session)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+        return
+    await websocket.accept()
+    await run_live_session(websocket, match_id, user_id=payload["sub"], pitch=pitch)
 
 
 @matches_router.delete("/{match_id}", status_code=204)
 async def delete_match(
     match_id: str = Path(...),
-    payload: dict = Depends(verify_token),
+    payload: dict = Depends(admit_user),
 ) -> Response:
     """Delete a match"""
     async with get_session_context() as session:
@@ -124,7 +437,130 @@ async def delete_match(
         return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+analytics_router = APIRouter(prefix="/analytics")
+
+
+@analytics_router.get("/season", response_model=SeasonAnalytics)
+async def season_analytics(
+    from_date: date | None = Query(None, alias="from"),
+    to_date: date | None = Query(None, alias="to"),
+    team: str | None = Query(None, description="Only matches where this team was the home or away team"),
+    payload: dict = Depends(admit_user),
+) -> SeasonAnalytics:
+    """Shot, assist, dribble and xG totals of both sides across all matches in a date range"""
+    async with get_read_session_context() as session:
+        return await get_season_analytics(payload["sub"], session, from_date=from_date, to_date=to_date, team=team)
+
+
+@analytics_router.get("/heatmap", response_model=Heatmap)
+async def heatmap(
+    bins_x: int = Query(21, ge=1, le=210, description="Bins along the pitch length"),
+    bins_y: int = Query(14, ge=1, le=136, description="Bins along the pitch width"),
+    side: Literal["team", "opponent"] | None = Query(None),
+    shot_type: Literal["on-target", "blocked", "off-target"] | None = Query(None),
+    is_header: bool | None = Query(None),
+    payload: dict = Depends(admit_user),
+) -> Heatmap:
+    """Shot and assist location counts across all matches binned on a grid over the pitch"""
+    async with get_read_session_context() as session:
+        return await get_heatmap(
+            payload["sub"],
+            session,
+            bins_x=bins_x,
+            bins_y=bins_y,
+            side=side,
+            shot_type=shot_type,
+            is_header=is_header,
+        )
+
+
+xg_router = APIRouter(prefix="/xg")
+
+
+@xg_router.get("/grid", response_model=XGGrid)
+async def xg_grid(
+    bins_x: int = Query(200, description="Cells along the pitch length"),
+    bins_y: int = Query(125, description="Cells along the pitch width"),
+    is_header: bool = Query(False),
+    model_version: int | None = Query(None, description="xG model version, defaults to the current one"),
+    if_none_match: str | None = Header(None),
+    payload: dict = Depends(admit_user),
+) -> XGGrid:
+    """
+    Precomputed xG of a shot from every cell of a grid over the pitch, for looking up hover xG without calculating it.
+    bins_x by bins_y must be one of XG_GRID_RESOLUTIONS. Grids are the same for every user, so responses may be cached
+    by shared caches.
+    """
+    if (bins_x, bins_y) not in XG_GRID_RESOLUTIONS:
+        resolutions = ", ".join(f"{x}x{y}" for x, y in XG_GRID_RESOLUTIONS)
+        raise HTTPException(status_code=400, detail=f"Grid size must be one of {resolutions}")
+    version = XG_MODEL_VERSION if model_version is None else model_version
+    if version not in XG_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown xG model version {version}")
+    etag = xg_grid_etag(bins_x, bins_y, is_header, version)
+    # A grid of a given model version never changes. Without a version the current model may change on deploy.
+    cache_control = "public, max-age=31536000, immutable" if model_version is not None else "public, max-age=86400"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # Calculating a grid that is not cached yet takes tens of milliseconds, too long to block the event loop
+    body = await run_in_threadpool(xg_grid_json, bins_x, bins_y, is_header, version)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+internal_router = APIRouter(prefix="/internal")
+
+
+@internal_router.get("/db-pool")
+async def db_pool(payload: dict = Depends(verify_admin)) -> dict:
+    """
+    Connection pool usage: current state and counters since the process started. read_replica is null unless
+    DATABASE_READ_URL is set.
+    """
+    engine, read_engine = get_engine(), get_read_engine()
+    return {
+        **pool_metrics.snapshot(engine),
+        "read_replica": read_pool_metrics.snapshot(read_engine) if read_engine is not engine else None,
+    }
+
+
+@internal_router.get("/admission")
+async def admission(payload: dict = Depends(verify_admin)) -> dict:
+    """Per-user admission control settings and counters since the process started"""
+    return admission_controller.stats()
+
+
+@internal_router.get("/token-cache")
+async def token_cache_stats(payload: dict = Depends(verify_admin)) -> dict:
+    """Verified token cache size and hit/miss counters since the process started"""
+    return token_cache.stats()
+
+
+@internal_router.post("/xg-recompute", response_model=XGRecomputeStatus, status_code=202)
+async def start_xg_recompute(payload: dict = Depends(verify_admin)) -> XGRecomputeStatus:
+    """Start rescoring all stored matches with the current xG model in the background"""
+    if xg_recompute_job.running:
+        raise HTTPException(status_code=409, detail="xG recompute is already running")
+    logger.info("Starting xG recompute", extra={"user_id": payload["sub"]})
+    return xg_recompute_job.start()
+
+
+@internal_router.get("/xg-recompute", response_model=XGRecomputeStatus)
+async def get_xg_recompute_status(payload: dict = Depends(verify_admin)) -> XGRecomputeStatus:
+    """Progress of the last xG recompute started by this process"""
+    return xg_recompute_job.status
+
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(verify_metrics_access)])
+async def metrics() -> PlainTextResponse:
+    """Per-route request latency, JWT verification and SQL statement histograms in the Prometheus text format"""
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 app.include_router(matches_router)
+app.include_router(analytics_router)
+app.include_router(xg_router)
+app.include_router(internal_router)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+"""
+Applies the SQL migrations in backend/migrations that the database has not had yet, and records them in schema_version.
+Run it out of band before deploying:
+    python src/migrate.py
+A database whose matchdb table create_all made before schema_version existed is baselined at 001 on the first run and
+gets all later migrations, which are idempotent. Pass --baseline <version> to record more of them as applied instead.
+"""
+import argparse
+import asyncio
+import logging
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlmodel import SQLModel
+
+from database import get_engine
+import models  # noqa: F401  Registers the tables in SQLModel.metadata
+from structured_logging import configure_logging
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+# Newest migration a database that predates schema_version is assumed to have
+INITIAL_VERSION = 1
+
+CREATE_SCHEMA_VERSION_SQL = text("""
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+)
+""")
+RECORD_VERSION_SQL = text("INSERT INTO schema_version (version) VALUES (:version) ON CONFLICT DO NOTHING")
+
+
+def find_migrations() -> dict[int, Path]:
+    """
+    Migration files by version, the number their name starts with
+    """
+    return {int(path.name.split("_", 1)[0]): path for path in sorted(MIGRATIONS_DIR.glob("[0-9]*_*.sql"))}
+
+
+def split_statements(sql: str) -> list[str]:
+    """
+    Statements of a migration file. Migrations must not contain semicolons other than statement ends.
+    """
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [statement.strip() for statement in "\n".join(lines).split(";") if statement.strip()]
+
+
+async def _applied_versions(conn: AsyncConnection) -> set[int]:
+    return set((await conn.scalars(text("SELECT version FROM schema_version"))).all())
+
+
+async def _table_exists(conn: AsyncConnection, table: str) -> bool:
+    return await conn.scalar(text("SELECT to_regclass(:table) IS NOT NULL"), {"table": table})
+
+
+async def migrate(baseline: int | None = None) -> None:
+    migrations = find_migrations()
+    engine = get_engine()
+    async with engine.begin() as conn:
+        has_versions = await _table_exists(conn, "schema_version")
+        has_matches = await _table_exists(conn, "matchdb")
+        await conn.execute(CREATE_SCHEMA_VERSION_SQL)
+        if not has_matches:
+            # Fresh database: the models are the current schema
+            logger.info("Creating schema of an empty database")
+            await conn.run_sync(SQLModel.metadata.create_all)
+            baseline = max(migrations)
+        elif not has_versions and baseline is None:
+            logger.info("Baselining a database that predates schema_version", extra={"version": INITIAL_VERSION})
+            baseline = INITIAL_VERSION
+        if baseline is not None:
+            for version in migrations:
+                if version <= baseline:
+                    await conn.execute(RECORD_VERSION_SQL, {"version": version})
+        applied = await _applied_versions(conn)
+
+    for version, path in sorted(migrations.items()):
+        if version in applied:
+            continue
+        logger.info("Applying migration", extra={"version": version, "file": path.name})
+        async with engine.begin() as conn:
+            for statement in split_statements(path.read_text()):
+                await conn.execute(text(statement))
+            await conn.execute(RECORD_VERSION_SQL, {"version": version})
+    logger.info("Database schema is up to date", extra={"version": max(migrations)})
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", type=int, help="Record migrations up to this version as applied without running them")
+    configure_logging()
+    asyncio.run(migrate(parser.parse_args().baseline))
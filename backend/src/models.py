@@ -1,39 +1,159 @@
-from datetime import date
-from pydantic import BaseModel
-from typing import Literal
+from datetime import date, datetime
+from pydantic import AfterValidator, AliasChoices, BaseModel, ConfigDict, Field as PydanticField, model_validator
+from typing import Annotated, Literal
 import uuid
 
 from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import DateTime, Index, func
 from sqlmodel import SQLModel, Field, Column
 
 
 class AssistAction(BaseModel):
+    model_config = ConfigDict(extra="allow")  # Keeps fields the frontend adds
+
     x: float
     y: float
     type: Literal["assist", "dribble"]
 
 
 class Action(BaseModel):
+    model_config = ConfigDict(extra="allow")  # Keeps fields the frontend adds, e.g. its own xG
+
     type: Literal["shot"]
     x: float
     y: float
     shot_type: Literal["on-target", "blocked", "off-target"]
-    is_header: bool
+    # The frontend sends the flag as header, older clients omit it
+    is_header: bool = PydanticField(False, validation_alias=AliasChoices("is_header", "header"))
     team: str
     assist: AssistAction | None = None
 
 
+PeriodType = Literal["Full Match", "First Half", "Second Half", "Extra"]
+
+
 class Period(BaseModel):
-    type: Literal["Full Match", "First Half", "Second Half", "Extra"]
+    type: PeriodType
     actions: list[Action]
 
 
+def _dump_periods(periods: list[Period]) -> list[dict]:
+    return [period.model_dump(exclude_unset=True) for period in periods]
+
+
+# Periods sent by clients: validated against Period, then kept as the plain dicts stored in MatchDB.periods
+ClientPeriods = Annotated[list[Period], AfterValidator(_dump_periods)]
+
+
+class ShotXG(BaseModel):
+    period: str
+    index: int  # Position of the shot in the period's actions list
+    team: str
+    xg: float
+
+
+class MatchXG(BaseModel):
+    match_id: str
+    model_version: int  # xg.XG_MODELS version the values were calculated with
+    shots: list[ShotXG]
+    team_totals: dict[str, float]
+
+
+class ActionPatch(BaseModel):
+    op: Literal["append", "remove"]
+    action: Action | None = None  # Required for append
+    index: int | None = None  # Required for remove. Negative values count from the end, -1 is the last action
+
+    @model_validator(mode="after")
+    def check_op_fields(self) -> "ActionPatch":
+        if self.op == "append" and self.action is None:
+            raise ValueError("action is required for append")
+        if self.op == "remove" and self.index is None:
+            raise ValueError("index is required for remove")
+        return self
+
+
+class TeamStats(BaseModel):
+    total_shots: int = 0
+    on_target: int = 0
+    blocked: int = 0
+    off_target: int = 0
+    assists: int = 0
+    dribbles: int = 0
+    xg: float = 0.0
+
+
+class MatchSummary(BaseModel):
+    team: TeamStats
+    opponent: TeamStats
+
+
+class SeasonStats(TeamStats):
+    on_target_rate: float = 0.0
+
+
+class SeasonAnalytics(BaseModel):
+    from_date: date | None
+    to_date: date | None
+    team_filter: str | None  # Only matches where this team was the home or away team
+    matches: int  # Matches with at least one shot
+    team: SeasonStats
+    opponent: SeasonStats
+
+
+class Heatmap(BaseModel):
+    bins_x: int  # Bins along the pitch length
+    bins_y: int  # Bins along the pitch width
+    pitch_length_m: float
+    pitch_width_m: float
+    # Counts per bin flattened row by row: index = x_bin * bins_y + y_bin
+    shots: list[int]
+    assists: list[int]  # Assist and dribble start locations
+
+
+class XGGrid(BaseModel):
+    bins_x: int  # Cells along the pitch length
+    bins_y: int  # Cells along the pitch width
+    is_header: bool
+    model_version: int
+    # xG of a shot from the center of each cell flattened row by row: index = x_bin * bins_y + y_bin
+    values: list[float]
+
+
+class XGRecomputeStatus(BaseModel):
+    state: Literal["idle", "running", "finished", "failed"]
+    model_version: int  # xG model the matches are rescored with
+    matches_rescored: int = 0
+    matches_skipped: int = 0  # Written by a client during the job, which already rescored them
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    error: str | None = None
+
+
+class LiveActionEvent(BaseModel):
+    """
+    Message a client sends over the live match WebSocket for each tagged action
+    """
+    period: PeriodType
+    action: Action
+
+
+class ActionPatchResult(BaseModel):
+    match_id: str
+    period: PeriodType
+    action_index: int  # Position of the appended or removed action in the period's actions list
+    summary: MatchSummary | None = None
+
+
 # Models are split to keep things clean:
 # - MatchBase holds shared fields to avoid duplication
 # - MatchDB is the full DB model (includes user_id for ownership). user_id must not be provided by the frontend because it is used
 #   to filter for rows in the DB. Altered user_id could grant unauthorized access to data.
 # - MatchCreate is duplication of the Base class but makes it more explicit for clients that that is the schema needed for creating objects.
 # - MatchPublic is what we return to clients (no user_id)
+# - MatchListItem is the slim version of MatchPublic returned by the match listing (no periods)
+# - summary is calculated by the BE whenever periods are written, so it is not part of MatchBase/MatchCreate
+# - periods is JSONB in MatchDB, so MatchCreate and MatchPublic validate what clients send against Period
 
 class MatchBase(SQLModel):
     match_name: str 
@@ -44,13 +164,88 @@ class MatchBase(SQLModel):
 
 
 class MatchDB(MatchBase, table=True):
+    # Serves the keyset pagination of the match listing
+    __table_args__ = (Index("ix_matchdb_user_id_date_match_id", "user_id", "date", "match_id"),)
+
     match_id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
     user_id: str  # Should be a foreign key but no user table exists yet
+    summary: dict | None = Field(default=None, sa_column=Column(JSONB))
+    # How periods are stored, see coordinates.PeriodsFormat. Clients always send and get actions with coordinates
+    # on their own pitch.
+    periods_format: str = "normalized"
+    # xg.XG_MODELS version of the xG in summary and the match's shot events
+    xg_model_version: int | None = None
+    # Set by the DB on every write, used for ETags
+    updated_at: datetime | None = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), server_default=func.now(), nullable=False),
+    )
+
+
+class ShotEvent(SQLModel, table=True):
+    """
+    Normalized copy of the shots in MatchDB.periods, one row per Action, for aggregations across matches.
+    MatchDB.periods stays the source of truth, rows are rewritten whenever a match's periods change.
+    """
+    __table_args__ = (
+        Index("ix_shotevent_user_id_team_shot_type", "user_id", "team", "shot_type"),
+        Index("ix_shotevent_user_id_date", "user_id", "date"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    match_id: str = Field(foreign_key="matchdb.match_id", ondelete="CASCADE", index=True)
+    user_id: str
+    date: date  # Copied from the match for date range queries
+    period: str  # Period.type
+    action_index: int  # Position of the action in the period's actions list
+    team: str
+    x: float  # 0..1 fraction of the pitch length
+    y: float  # 0..1 fraction of the pitch width
+    shot_type: str
+    is_header: bool
+    assist_type: str | None = None  # AssistAction.type
+    assist_x: float | None = None
+    assist_y: float | None = None
+    xg: float
 
 
 class MatchCreate(MatchBase):
-    pass
+    periods: ClientPeriods
 
 
 class MatchPublic(MatchBase):
+    periods: ClientPeriods
     match_id: str  # UUID created by BE (the default factory) when adding the match to our DB for the first time
+    summary: MatchSummary | None = None
+    xg_model_version: int | None = None
+    updated_at: datetime | None = None
+
+
+class MatchListItem(SQLModel):
+    match_id: str
+    match_name: str
+    home_team: str | None = None
+    away_team: str | None = None
+    date: date
+    summary: MatchSummary | None = None
+    updated_at: datetime | None = None
+
+
+class MatchPage(SQLModel):
+    items: list[MatchListItem]
+    next_cursor: str | None = None  # Pass as cursor to get the next page, None on the last page
+
+
+class MatchBatch(SQLModel):
+    matches: dict[str, MatchPublic]  # By match_id
+    missing: list[str]  # Requested ids that do not exist or belong to another user
+
+
+class BulkImportError(BaseModel):
+    row: int  # 1-based position of the record in the request body
+    error: str
+
+
+class BulkImportResult(BaseModel):
+    created: list[str]  # match ids of the created matches
+    errors: list[BulkImportError]
@@ -0,0 +1,331 @@
+import json
+import logging
+
+from fastapi import HTTPException
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from coordinates import FRONTEND_PITCH, PitchSize, load_periods, normalize_action, scale_action, store_periods
+from crud_operations import PERIODS_STORAGE_FORMAT
+from models import Action, ActionPatchResult, MatchDB, TeamStats
+from shot_events import (
+    insert_shot_events_rows,
+    remove_shot_event,
+    replace_shot_events,
+    shot_event_row,
+    shot_event_rows,
+)
+from stats import get_action_stats, get_match_summary, summary_side
+from user_cache import analytics_cache
+from xg import XG_MODEL_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Position of the period in the periods array, NULL if the match has no such period yet
+_PERIOD_INDEX_SQL = """
+    CAST((
+        SELECT period.ord - 1
+        FROM jsonb_array_elements(periods) WITH ORDINALITY AS period(value, ord)
+        WHERE period.value ->> 'type' = :period
+        LIMIT 1
+    ) AS int)
+"""
+
+# Appends to the end of the period's actions, or adds the period if the match does not have it yet.
+# Matches stored in pixels get the action in pixels. Columnar matches and matches scored with another xG model
+# are edited in Python instead.
+APPEND_ACTION_SQL = f"""
+WITH target AS (
+    SELECT
+        match_id,
+        {_PERIOD_INDEX_SQL} AS period_index,
+        CASE WHEN periods_format = 'pixels' THEN CAST(:pixels_action AS jsonb) ELSE CAST(:action AS jsonb) END AS action
+    FROM matchdb
+    WHERE user_id = :user_id AND match_id = :match_id
+        AND periods_format <> 'columnar' AND xg_model_version = :xg_model_version
+    FOR UPDATE
+)
+UPDATE matchdb
+SET
+    periods = CASE
+        WHEN target.period_index IS NULL THEN matchdb.periods || jsonb_build_array(
+            jsonb_build_object('type', CAST(:period AS text), 'actions', jsonb_build_array(target.action))
+        )
+        ELSE jsonb_insert(
+            matchdb.periods,
+            ARRAY[CAST(target.period_index AS text), 'actions', '-1'],
+            target.action,
+            true
+        )
+    END,
+    summary = {{summary}},
+    updated_at = now()
+FROM target
+WHERE matchdb.match_id = target.match_id
+RETURNING
+    matchdb.date,
+    matchdb.summary,
+    jsonb_array_length(
+        matchdb.periods
+        -> CAST(COALESCE(target.period_index, jsonb_array_length(matchdb.periods) - 1) AS int)
+        -> 'actions'
+    ) - 1 AS action_index
+"""
+
+# Removes one action and returns it so the summary and shot events can be updated.
+# Columnar matches and matches scored with another xG model are edited in Python instead.
+REMOVE_ACTION_SQL = f"""
+WITH located AS (
+    SELECT match_id, periods, {_PERIOD_INDEX_SQL} AS period_index
+    FROM matchdb
+    WHERE user_id = :user_id AND match_id = :match_id
+        AND periods_format <> 'columnar' AND xg_model_version = :xg_model_version
+    FOR UPDATE
+),
+target AS (
+    SELECT match_id, period_index, action_index, periods -> period_index -> 'actions' -> action_index AS action
+    FROM (
+        SELECT
+            match_id,
+            periods,
+            period_index,
+            CASE
+                WHEN :action_index < 0 THEN jsonb_array_length(periods -> period_index -> 'actions') + :action_index
+                ELSE :action_index
+            END AS action_index
+        FROM located
+    ) AS resolved
+)
+UPDATE matchdb
+SET
+    periods = matchdb.periods #- ARRAY[CAST(target.period_index AS text), 'actions', CAST(target.action_index AS text)],
+    updated_at = now()
+FROM target
+WHERE matchdb.match_id = target.match_id AND target.action_index >= 0 AND target.action IS NOT NULL
+RETURNING matchdb.date, matchdb.periods_format, target.action_index, target.action
+"""
+
+UPDATE_SUMMARY_SQL = """
+UPDATE matchdb
+SET summary = {summary}
+WHERE user_id = :user_id AND match_id = :match_id
+RETURNING summary
+"""
+
+
+def _summary_update_sql(side: str, delta: TeamStats) -> tuple[str, dict]:
+    """
+    SQL expression adding the delta to the stored summary with jsonb_set, so the summary is updated without
+    reading the match. side and field names come from MatchSummary/TeamStats, only the values are parameters.
+    Matches stored before summaries existed keep a NULL summary.
+    """
+    expression = "matchdb.summary"
+    params = {}
+    for field, value in delta.model_dump().items():
+        if value:
+            path = f"'{{{side},{field}}}'"
+            expression = (
+                f"jsonb_set({expression}, {path}, "
+                f"to_jsonb(CAST(matchdb.summary #>> {path} AS float) + :delta_{field}))"
+            )
+            params[f"delta_{field}"] = float(value)
+    return expression, params
+
+
+def _append_to_periods(periods: list[dict], period: str, action: dict) -> int:
+    """
+    Appends the action to the period, adding the period if needed. Returns the action's index.
+    """
+    target = next((p for p in periods if p["type"] == period), None)
+    if target is None:
+        target = {"type": period, "actions": []}
+        periods.append(target)
+    target["actions"].append(action)
+    return len(target["actions"]) - 1
+
+
+async def _patch_match(
+    match_id: str,
+    user_id: str,
+    period: str,
+    session: AsyncSession,
+    action: dict | None = None,
+    index: int | None = None,
+) -> tuple[MatchDB, int, dict] | None:
+    """
+    Appends (action given) or removes (index given) an action by loading, editing and storing the whole periods,
+    and recalculates the summary with the current xG model. Used for columnar matches and matches scored with
+    another xG model. Returns the updated match, the action's index and the action, None if the match, period or
+    action does not exist.
+    """
+    statement = select(MatchDB).where(MatchDB.user_id == user_id, MatchDB.match_id == match_id).with_for_update()
+    match = (await session.scalars(statement)).first()
+    if match is None:
+        return None
+
+    periods = load_periods(match.periods, match.periods_format)
+    if action is not None:
+        action_index = _append_to_periods(periods, period, action)
+    else:
+        target = next((p for p in periods if p["type"] == period), None)
+        if target is None or not -len(target["actions"]) <= index < len(target["actions"]):
+            return None
+        action_index = index % len(target["actions"])
+        action = target["actions"].pop(action_index)
+
+    statement = (
+        update(MatchDB)
+        .where(MatchDB.user_id == user_id, MatchDB.match_id == match_id)
+        .values(
+            # Rewritten in the storage format, pixels periods would pick up float noise on every write
+            periods=store_periods(periods, PERIODS_STORAGE_FORMAT),
+            periods_format=PERIODS_STORAGE_FORMAT,
+            summary=get_match_summary(periods).model_dump(),
+            xg_model_version=XG_MODEL_VERSION,
+            updated_at=func.now(),
+        )
+        .returning(MatchDB)
+        .execution_options(populate_existing=True)
+    )
+    updated_match = (await session.scalars(statement)).one()
+    return updated_match, action_index, action
+
+
+async def append_action_in_db(
+    match_id: str,
+    user_id: str,
+    period: str,
+    action: Action,
+    session: AsyncSession,
+    pitch: PitchSize = FRONTEND_PITCH,
+) -> ActionPatchResult:
+    logger.info("Appending action", extra={"user_id": user_id, "match_id": match_id, "period": period})
+    action_data = normalize_action(action.model_dump(exclude_unset=True), pitch)
+    action_stats = get_action_stats(action_data)
+    summary_sql, summary_params = _summary_update_sql(summary_side(action_data), action_stats)
+    statement = text(APPEND_ACTION_SQL.format(summary=summary_sql)).columns(summary=JSONB)
+    result = await session.execute(
+        statement,
+        {
+            "match_id": match_id,
+            "user_id": user_id,
+            "period": period,
+            "action": json.dumps(action_data),
+            "pixels_action": json.dumps(scale_action(action_data, FRONTEND_PITCH)),
+            "xg_model_version": XG_MODEL_VERSION,
+            **summary_params,
+        },
+    )
+    row = result.first()
+    if row is not None:
+        action_index, summary = row.action_index, row.summary
+        await insert_shot_events_rows(
+            [shot_event_row(match_id, user_id, row.date, period, action_index, action_data, action_stats.xg)],
+            session,
+        )
+    else:
+        patched = await _patch_match(match_id, user_id, period, session, action=action_data)
+        if patched is None:
+            logger.info("Match not found", extra={"user_id": user_id, "match_id": match_id})
+            raise HTTPException(status_code=404, detail="Match not found")
+        match, action_index, _ = patched
+        summary = match.summary
+        await replace_shot_events(match, session)
+
+    analytics_cache.invalidate_on_commit(session, user_id)
+    return ActionPatchResult(match_id=match_id, period=period, action_index=action_index, summary=summary)
+
+
+async def remove_action_from_db(
+    match_id: str,
+    user_id: str,
+    period: str,
+    index: int,
+    session: AsyncSession,
+) -> ActionPatchResult:
+    logger.info(
+        "Removing action", extra={"user_id": user_id, "match_id": match_id, "period": period, "index": index}
+    )
+    statement = text(REMOVE_ACTION_SQL).columns(action=JSONB)
+    result = await session.execute(
+        statement,
+        {
+            "match_id": match_id,
+            "user_id": user_id,
+            "period": period,
+            "action_index": index,
+            "xg_model_version": XG_MODEL_VERSION,
+        },
+    )
+    row = result.first()
+    if row is not None:
+        action_index = row.action_index
+        action = normalize_action(row.action, FRONTEND_PITCH) if row.periods_format == "pixels" else row.action
+        summary_sql, summary_params = _summary_update_sql(summary_side(action), get_action_stats(action, sign=-1))
+        summary_result = await session.execute(
+            text(UPDATE_SUMMARY_SQL.format(summary=summary_sql)).columns(summary=JSONB),
+            {"match_id": match_id, "user_id": user_id, **summary_params},
+        )
+        summary = summary_result.scalar_one()
+        await remove_shot_event(match_id, user_id, period, action_index, session)
+    else:
+        patched = await _patch_match(match_id, user_id, period, session, index=index)
+        if patched is None:
+            logger.info(
+                "Action not found",
+                extra={"user_id": user_id, "match_id": match_id, "period": period, "index": index},
+            )
+            raise HTTPException(status_code=404, detail="Match, period or action not found")
+        match, action_index, _ = patched
+        summary = match.summary
+        await replace_shot_events(match, session)
+
+    analytics_cache.invalidate_on_commit(session, user_id)
+    return ActionPatchResult(match_id=match_id, period=period, action_index=action_index, summary=summary)
+
+
+async def append_actions_in_db(
+    match_id: str,
+    user_id: str,
+    actions: list[tuple[str, dict]],
+    session: AsyncSession,
+) -> tuple[MatchDB, list[int]]:
+    """
+    Appends many (period, action) pairs with normalized coordinates in one read-modify-write of the match, used to
+    write coalesced live actions. Returns the updated match and the index of each action in its period.
+    """
+    logger.info("Appending actions", extra={"user_id": user_id, "match_id": match_id, "actions": len(actions)})
+    statement = select(MatchDB).where(MatchDB.user_id == user_id, MatchDB.match_id == match_id).with_for_update()
+    match = (await session.scalars(statement)).first()
+    if match is None:
+        logger.info("Match not found", extra={"user_id": user_id, "match_id": match_id})
+        raise HTTPException(status_code=404, detail="Match not found")
+    scored_with_current_model = match.xg_model_version == XG_MODEL_VERSION
+
+    periods = load_periods(match.periods, match.periods_format)
+    indexes = [_append_to_periods(periods, period, action) for period, action in actions]
+    statement = (
+        update(MatchDB)
+        .where(MatchDB.user_id == user_id, MatchDB.match_id == match_id)
+        .values(
+            # Rewritten in the storage format, pixels periods would pick up float noise on every write
+            periods=store_periods(periods, PERIODS_STORAGE_FORMAT),
+            periods_format=PERIODS_STORAGE_FORMAT,
+            summary=get_match_summary(periods).model_dump(),
+            xg_model_version=XG_MODEL_VERSION,
+            updated_at=func.now(),
+        )
+        .returning(MatchDB)
+        .execution_options(populate_existing=True)
+    )
+    updated_match = (await session.scalars(statement)).one()
+
+    if scored_with_current_model:
+        new_actions = {(period, index) for (period, _), index in zip(actions, indexes)}
+        rows = [row for row in shot_event_rows(updated_match) if (row["period"], row["action_index"]) in new_actions]
+        await insert_shot_events_rows(rows, session)
+    else:
+        await replace_shot_events(updated_match, session)
+    analytics_cache.invalidate_on_commit(session, user_id)
+    return updated_match, indexes
@@ -0,0 +1,97 @@
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class PoolMetrics:
+    """
+    Counters of connection pool use, filled from SQLAlchemy pool events and InstrumentedPool
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0  # New DB connections opened
+        self.closes = 0  # Connections closed for good, e.g. recycled or failed pre-ping
+        self.invalidations = 0
+        self.timeouts = 0  # Checkouts that gave up after pool_timeout
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def attach(self, engine: AsyncEngine) -> None:
+        sync_engine = engine.sync_engine
+
+        @event.listens_for(sync_engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            self.connects += 1
+
+        @event.listens_for(sync_engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self.checkouts += 1
+
+        @event.listens_for(sync_engine, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            self.checkins += 1
+
+        @event.listens_for(sync_engine, "close")
+        def on_close(dbapi_connection, connection_record):
+            self.closes += 1
+
+        @event.listens_for(sync_engine, "invalidate")
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            self.invalidations += 1
+
+    def snapshot(self, engine: AsyncEngine) -> dict:
+        pool = engine.pool
+        return {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "connects": self.connects,
+            "closes": self.closes,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+            "wait_seconds_avg": self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+        }
+
+
+# Primary engine (DATABASE_URL) and read replica engine (DATABASE_READ_URL)
+pool_metrics = PoolMetrics()
+read_pool_metrics = PoolMetrics()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long each checkout waited for a connection, including opening a new one
+    """
+
+    metrics = pool_metrics
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - start)
+
+
+class ReadInstrumentedPool(InstrumentedPool):
+    """
+    InstrumentedPool of the read replica engine, a class of its own so that recreated pools keep their metrics
+    """
+
+    metrics = read_pool_metrics
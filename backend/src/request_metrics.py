@@ -0,0 +1,139 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the SQL statements per request histogram buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestTimings:
+    """
+    Time spent in the parts of one request. Filled by verify_token and the engine's cursor events.
+    """
+
+    def __init__(self):
+        self.jwt_seconds = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+
+# Timings of the request being handled. Set by the middleware before the handler runs, so the object is shared with
+# the tasks and greenlets the request spawns.
+current_timings: ContextVar[RequestTimings | None] = ContextVar("current_timings", default=None)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram: observation counts per bucket, plus their sum and total count
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+# Metric name -> (help text, buckets)
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("Time to handle the request, until the response headers", LATENCY_BUCKETS),
+    "http_request_jwt_seconds": ("Time spent verifying the JWT", LATENCY_BUCKETS),
+    "http_request_db_queries": ("SQL statements executed per request", QUERY_COUNT_BUCKETS),
+    "http_request_db_seconds": ("Time spent executing SQL statements", LATENCY_BUCKETS),
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class RequestMetrics:
+    """
+    Per-route histograms of request latency, JWT verification and SQL statements, rendered for /metrics
+    """
+
+    def __init__(self):
+        # (method, route) -> metric name -> Histogram
+        self.histograms: dict[tuple[str, str], dict[str, Histogram]] = {}
+        # (method, route, status) -> request count
+        self.responses: dict[tuple[str, str, int], int] = {}
+
+    def attach(self, engine: AsyncEngine) -> None:
+        """
+        Counts and times every statement executed while a request is being handled
+        """
+        sync_engine = engine.sync_engine
+
+        @event.listens_for(sync_engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(sync_engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["query_start"].pop()
+            timings = current_timings.get()
+            if timings is not None:
+                timings.sql_count += 1
+                timings.sql_seconds += elapsed
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, timings: RequestTimings) -> None:
+        key = (method, route)
+        if key not in self.histograms:
+            self.histograms[key] = {name: Histogram(buckets) for name, (_, buckets) in HISTOGRAMS.items()}
+        histograms = self.histograms[key]
+        histograms["http_request_duration_seconds"].observe(seconds)
+        histograms["http_request_jwt_seconds"].observe(timings.jwt_seconds)
+        histograms["http_request_db_queries"].observe(timings.sql_count)
+        histograms["http_request_db_seconds"].observe(timings.sql_seconds)
+        response_key = (method, route, status_code)
+        self.responses[response_key] = self.responses.get(response_key, 0) + 1
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = [
+            "# HELP http_requests_total Handled requests by route and status code",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status_code), count in sorted(self.responses.items()):
+            lines.append(
+                f'http_requests_total{{method="{method}",route="{_escape(route)}",status="{status_code}"}} {count}'
+            )
+        for name, (help_text, _) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (method, route), histograms in sorted(self.histograms.items()):
+                lines.extend(histograms[name].render(name, f'method="{method}",route="{_escape(route)}"'))
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+def server_timing_header(seconds: float, timings: RequestTimings) -> str:
+    return (
+        f"app;dur={seconds * 1000:.2f}, "
+        f"jwt;dur={timings.jwt_seconds * 1000:.2f}, "
+        f'db;dur={timings.sql_seconds * 1000:.2f};desc="{timings.sql_count} queries"'
+    )
@@ -0,0 +1,132 @@
+import asyncio
+from datetime import date
+import logging
+
+from sqlalchemy import delete, insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from coordinates import load_periods
+from models import MatchDB, ShotEvent
+from structured_logging import configure_logging
+from xg import calculate_match_xg
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 100
+
+
+def shot_event_row(
+    match_id: str,
+    user_id: str,
+    match_date: date,
+    period: str,
+    index: int,
+    action: dict,
+    xg: float,
+) -> dict:
+    assist = action.get("assist") or {}
+    return {
+        "match_id": match_id,
+        "user_id": user_id,
+        "date": match_date,
+        "period": period,
+        "action_index": index,
+        "team": action["team"],
+        "x": action["x"],
+        "y": action["y"],
+        "shot_type": action["shot_type"],
+        "is_header": action.get("is_header", False),
+        "assist_type": assist.get("type"),
+        "assist_x": assist.get("x"),
+        "assist_y": assist.get("y"),
+        "xg": xg,
+    }
+
+
+def shot_event_rows(match: MatchDB) -> list[dict]:
+    shots, xg = calculate_match_xg(load_periods(match.periods, match.periods_format))
+    return [
+        shot_event_row(match.match_id, match.user_id, match.date, period, index, action, shot_xg)
+        for (period, index, action), shot_xg in zip(shots, xg.tolist())
+    ]
+
+
+async def insert_shot_events_rows(rows: list[dict], session: AsyncSession) -> None:
+    """
+    Inserts the rows as an executemany, which SQLAlchemy sends as multi-row INSERTs in pages, so a large batch stays
+    under the 32767 bind parameters a Postgres statement may have
+    """
+    if rows:
+        await session.execute(insert(ShotEvent), rows)
+
+
+async def insert_shot_events(matches: list[MatchDB], session: AsyncSession) -> None:
+    await insert_shot_events_rows([row for match in matches for row in shot_event_rows(match)], session)
+
+
+async def delete_shot_events(match_ids: list[str], user_id: str, session: AsyncSession) -> None:
+    await session.execute(
+        delete(ShotEvent).where(ShotEvent.user_id == user_id, ShotEvent.match_id.in_(match_ids))
+    )
+
+
+async def remove_shot_event(match_id: str, user_id: str, period: str, index: int, session: AsyncSession) -> None:
+    """
+    Removes the shot event of a single removed action and shifts the later actions of the period down by one,
+    same as removing the action from the period's actions list does.
+    """
+    await session.execute(
+        delete(ShotEvent).where(
+            ShotEvent.user_id == user_id,
+            ShotEvent.match_id == match_id,
+            ShotEvent.period == period,
+            ShotEvent.action_index == index,
+        )
+    )
+    await session.execute(
+        update(ShotEvent)
+        .where(
+            ShotEvent.user_id == user_id,
+            ShotEvent.match_id == match_id,
+            ShotEvent.period == period,
+            ShotEvent.action_index > index,
+        )
+        .values(action_index=ShotEvent.action_index - 1)
+    )
+
+
+async def replace_shot_events(match: MatchDB, session: AsyncSession) -> None:
+    await delete_shot_events([match.match_id], match.user_id, session)
+    await insert_shot_events([match], session)
+
+
+async def backfill_shot_events() -> None:
+    """
+    Rebuilds the shot events of all stored matches, one batch of matches per transaction.
+    Run with `python src/shot_events.py`.
+    """
+    from database import get_session_context
+
+    last_match_id = ""
+    total = 0
+    while True:
+        async with get_session_context() as session:
+            statement = (
+                select(MatchDB)
+                .where(MatchDB.match_id > last_match_id)
+                .order_by(MatchDB.match_id)
+                .limit(BACKFILL_BATCH_SIZE)
+            )
+            matches = (await session.scalars(statement)).all()
+            if not matches:
+                break
+            await session.execute(delete(ShotEvent).where(ShotEvent.match_id.in_([m.match_id for m in matches])))
+            await insert_shot_events(matches, session)
+        last_match_id = matches[-1].match_id
+        total += len(matches)
+        logger.info("Backfilled shot events", extra={"matches": total})
+
+
+if __name__ == "__main__":
+    configure_logging()
+    asyncio.run(backfill_shot_events())
@@ -0,0 +1,54 @@
+from models import MatchSummary, TeamStats
+from xg import XG_MODEL_VERSION, calculate_match_xg, calculate_xg
+
+
+def add_action_to_stats(stats: TeamStats, action: dict, xg: float, sign: int = 1) -> None:
+    """
+    Adds (or with sign=-1 removes) a single shot to the stats of its team.
+    """
+    stats.total_shots += sign
+
+    if action.get("shot_type") == "on-target":
+        stats.on_target += sign
+    if action.get("shot_type") == "blocked":
+        stats.blocked += sign
+    if action.get("shot_type") == "off-target":
+        stats.off_target += sign
+
+    stats.xg += sign * xg
+
+    assist = action.get("assist")
+    if assist:
+        if assist.get("type") == "assist":
+            stats.assists += sign
+        if assist.get("type") == "dribble":
+            stats.dribbles += sign
+
+
+def summary_side(action: dict) -> str:
+    """
+    Key of the MatchSummary field the action counts towards
+    """
+    return "team" if action.get("team") == "team" else "opponent"
+
+
+def get_action_stats(action: dict, sign: int = 1) -> TeamStats:
+    """
+    Stats of a single shot with normalized coordinates, used to update a stored summary without reading the whole match.
+    """
+    stats = TeamStats()
+    xg = calculate_xg([action["x"]], [action["y"]], [action.get("is_header", False)], pitch_length_px=1, pitch_width_px=1)
+    add_action_to_stats(stats, action, float(xg[0]), sign)
+    return stats
+
+
+def get_match_summary(periods: list[dict], model_version: int = XG_MODEL_VERSION) -> MatchSummary:
+    """
+    Backend version of getStatsFromActions. Counts shots, their outcomes, assists, dribbles and xG for both teams.
+    Periods must have normalized coordinates.
+    """
+    summary = MatchSummary(team=TeamStats(), opponent=TeamStats())
+    shots, xg = calculate_match_xg(periods, model_version)
+    for (_, _, action), shot_xg in zip(shots, xg.tolist()):
+        add_action_to_stats(getattr(summary, summary_side(action)), action, shot_xg)
+    return summary
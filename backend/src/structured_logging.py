@@ -0,0 +1,108 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Longest logged field value. Longer strings are cut, containers are logged as their type and size.
+LOG_MAX_VALUE_LENGTH = int(os.environ.get("LOG_MAX_VALUE_LENGTH", "200"))
+# Fraction of records below WARNING kept per logger, e.g. "crud_operations=0.1,xg=0". Other loggers keep all.
+LOG_SAMPLING = {
+    name.strip(): float(rate)
+    for name, rate in (item.split("=") for item in os.environ.get("LOG_SAMPLING", "").split(",") if item.strip())
+}
+
+# Attributes every LogRecord has. Anything else was passed in extra and is logged as a key=value field.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def format_value(value, max_length: int = LOG_MAX_VALUE_LENGTH) -> str:
+    """
+    Short representation of a field value. Containers are never expanded, so a match's periods cost nothing to log.
+    """
+    if isinstance(value, (dict, list, tuple, set)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    text = str(value)
+    if len(text) > max_length:
+        text = f"{text[:max_length]}...<{len(text)} chars>"
+    if not text or any(char.isspace() or char in '"=' for char in text):
+        text = '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    Formats records as key=value pairs: time, level, logger and message first, then the fields passed in extra
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        line = " ".join(f"{key}={format_value(value)}" for key, value in fields.items())
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line = f"{line}\n{record.exc_text}"
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a random fraction of a logger's records below WARNING. Rates of parent loggers apply to their children.
+    """
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        name = record.name
+        while name:
+            if name in self.rates:
+                return random.random() < self.rates[name]
+            name = name.rpartition(".")[0]
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens in the listener thread. Only the traceback is rendered here, while it still exists.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging() -> logging.handlers.QueueListener:
+    """
+    Sends all records through a queue to a listener thread that formats and writes them,
+    so logging never blocks the event loop on I/O
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLING))
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(KeyValueFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
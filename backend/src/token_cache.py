@@ -0,0 +1,50 @@
+from collections import OrderedDict
+import hashlib
+import time
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified JWT payloads keyed on the SHA-256 of the token. Entries are dropped once the
+    token's exp has passed, so an expired token is always verified (and rejected) again by jwt.decode.
+    Not thread-safe, meant to be used from the event loop only.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> dict | None:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, token: str, payload: dict) -> None:
+        # Tokens without exp never expire in jwt.decode either, but caching them forever is not worth the risk
+        expires_at = payload.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            return
+        key = self._key(token)
+        self._entries[key] = (float(expires_at), payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+import time
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# Session.info key of the (cache, user_id) pairs to invalidate when the session's transaction commits
+_PENDING_INVALIDATIONS = "user_cache_invalidations"
+
+
+class UserCache:
+    """
+    In-process cache of per-user results. Write paths call invalidate_on_commit(session, user_id) so a user's own
+    changes are visible right away. The TTL bounds staleness across worker processes, which do not see each other's
+    invalidations. Expired entries are dropped on the next put for the user, and each user keeps at most
+    max_entries_per_user entries, least recently used first out. Not thread-safe, meant to be used from the event
+    loop only.
+    """
+
+    def __init__(self, max_users: int = 1024, max_entries_per_user: int = 64, ttl_seconds: float = 60):
+        self.max_users = max_users
+        self.max_entries_per_user = max_entries_per_user
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, OrderedDict[Any, tuple[float, Any]]] = OrderedDict()
+
+    def get(self, user_id: str, key: Any) -> Any | None:
+        user_entries = self._entries.get(user_id)
+        entry = user_entries.get(key) if user_entries is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            del user_entries[key]
+            self.misses += 1
+            return None
+        user_entries.move_to_end(key)
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, user_id: str, key: Any, value: Any) -> None:
+        now = time.monotonic()
+        user_entries = self._entries.setdefault(user_id, OrderedDict())
+        for expired_key in [cached_key for cached_key, (expires_at, _) in user_entries.items() if expires_at <= now]:
+            del user_entries[expired_key]
+        user_entries[key] = (now + self.ttl_seconds, value)
+        user_entries.move_to_end(key)
+        while len(user_entries) > self.max_entries_per_user:
+            user_entries.popitem(last=False)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.pop(user_id, None)
+
+    def invalidate_on_commit(self, session: AsyncSession, user_id: str) -> None:
+        """
+        Invalidates the user's entries once the session's transaction commits. Invalidating before the commit would
+        let a read in between cache the old results again until the TTL runs out.
+        """
+        session.sync_session.info.setdefault(_PENDING_INVALIDATIONS, set()).add((self, user_id))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "users": len(self._entries),
+            "entries": sum(len(user_entries) for user_entries in self._entries.values()),
+            "max_users": self.max_users,
+            "max_entries_per_user": self.max_entries_per_user,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session: Session) -> None:
+    for cache, user_id in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session: Session) -> None:
+    session.info.pop(_PENDING_INVALIDATIONS, None)
+
+
+# Season analytics and other aggregations over all matches of a user
+analytics_cache = UserCache()
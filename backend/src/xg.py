@@ -0,0 +1,124 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Real pitch and goal dimensions in meters
+PITCH_LENGTH_M = 105
+PITCH_WIDTH_M = 68
+GOAL_WIDTH_M = 8.05  # Original reference's scaled goal width in meters
+
+# Size of the #football-pitch element in the frontend. Action coordinates are stored in these pixels.
+# NOTE: Width of the pitch element is used as a length and vice versa, same as in the frontend.
+PITCH_LENGTH_PX = 800
+PITCH_WIDTH_PX = 500
+
+# Logistic regression coefficients, same as calculateXG in frontend/utils/expected_goals.js
+XG_COEFFICIENTS = {
+    "intercept": -1.745598,
+    "angle": 1.338737,
+    "distance": -0.110384,
+    "header": 0.646730,
+    "angle_distance": 0.168798,
+    "angle_header": -0.424885,
+    "distance_header": -0.134178,
+    "angle_distance_header": -0.055093,
+}
+
+# Versioned xG models. Never change a version's coefficients: add a new version and rescore the stored matches
+# with `python src/xg_recompute.py`, so every stored xG value can be traced to the model that produced it.
+XG_MODELS: dict[int, dict[str, float]] = {
+    1: XG_COEFFICIENTS,
+}
+# Version new xG values are calculated with
+XG_MODEL_VERSION = max(XG_MODELS)
+
+
+def extract_shots(periods: list[dict]) -> list[tuple[str, int, dict]]:
+    """
+    Flattens the periods JSONB blob into (period type, index within period, action) tuples for all shots.
+    """
+    shots = []
+    for period in periods:
+        for index, action in enumerate(period.get("actions", [])):
+            if action.get("type") == "shot":
+                shots.append((period.get("type"), index, action))
+    return shots
+
+
+def to_pitch_meters(
+    x: np.ndarray,
+    y: np.ndarray,
+    pitch_length_px: float = PITCH_LENGTH_PX,
+    pitch_width_px: float = PITCH_WIDTH_PX,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts pixel coordinates on the frontend pitch to real-world meters
+    """
+    pitch_x = np.asarray(x, dtype=np.float64) * PITCH_LENGTH_M / pitch_length_px  # Length in meters (goal to goal)
+    pitch_y = np.asarray(y, dtype=np.float64) * PITCH_WIDTH_M / pitch_width_px  # Width in meters (sideline to sideline)
+    return pitch_x, pitch_y
+
+
+def calculate_xg(
+    x: np.ndarray,
+    y: np.ndarray,
+    is_header: np.ndarray,
+    pitch_length_px: float = PITCH_LENGTH_PX,
+    pitch_width_px: float = PITCH_WIDTH_PX,
+    model_version: int = XG_MODEL_VERSION,
+) -> np.ndarray:
+    """
+    Vectorized version of calculateXG. Takes pixel coordinates and header flags of any number of shots
+    and returns their xG values in one pass.
+    """
+    pitch_x, pitch_y = to_pitch_meters(x, y, pitch_length_px, pitch_width_px)
+    header = np.asarray(is_header, dtype=np.float64)
+
+    # Goal is centered on the right end of the pitch
+    goal_center_x = PITCH_LENGTH_M
+    goal_center_y = PITCH_WIDTH_M / 2
+    half_goal_width = GOAL_WIDTH_M / 2
+
+    dist_near_post = np.hypot(pitch_x - goal_center_x, pitch_y - (goal_center_y - half_goal_width))
+    dist_far_post = np.hypot(pitch_x - goal_center_x, pitch_y - (goal_center_y + half_goal_width))
+
+    # Angle between posts using cosine rule. Clipping guards against rounding errors just outside [-1, 1]
+    # and the division by zero of a shot taken exactly on a post.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos_angle = (dist_near_post**2 + dist_far_post**2 - GOAL_WIDTH_M**2) / (2 * dist_near_post * dist_far_post)
+    goal_angle = np.arccos(np.clip(np.nan_to_num(cos_angle, nan=1.0), -1.0, 1.0))
+
+    goal_distance = np.hypot(goal_center_x - pitch_x, goal_center_y - pitch_y)
+
+    c = XG_MODELS[model_version]
+    logit = (
+        c["intercept"]
+        + c["angle"] * goal_angle
+        + c["distance"] * goal_distance
+        + c["header"] * header
+        + c["angle_distance"] * goal_angle * goal_distance
+        + c["angle_header"] * goal_angle * header
+        + c["distance_header"] * goal_distance * header
+        + c["angle_distance_header"] * goal_angle * goal_distance * header
+    )
+    return 1 / (1 + np.exp(-logit))
+
+
+def calculate_match_xg(
+    periods: list[dict],
+    model_version: int = XG_MODEL_VERSION,
+) -> tuple[list[tuple[str, int, dict]], np.ndarray]:
+    """
+    Computes xG for every shot in a match. Periods must have normalized coordinates (see coordinates.load_periods).
+    Returns the shots (see extract_shots) and their xG values in the same order.
+    """
+    shots = extract_shots(periods)
+    x = np.fromiter((action["x"] for _, _, action in shots), dtype=np.float64, count=len(shots))
+    y = np.fromiter((action["y"] for _, _, action in shots), dtype=np.float64, count=len(shots))
+    is_header = np.fromiter((action.get("is_header", False) for _, _, action in shots), dtype=bool, count=len(shots))
+    # Normalized coordinates are pixels on a 1x1 pitch
+    xg = calculate_xg(x, y, is_header, pitch_length_px=1, pitch_width_px=1, model_version=model_version)
+    logger.debug("Calculated xG", extra={"shots": len(shots), "model_version": model_version})
+    return shots, xg
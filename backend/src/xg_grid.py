@@ -0,0 +1,50 @@
+from functools import lru_cache
+import logging
+import os
+
+from dotenv import load_dotenv
+import numpy as np
+import orjson
+
+from xg import calculate_xg
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Grids kept serialized in memory, each (bins_x, bins_y, is_header, model version) combination is one entry
+XG_GRID_CACHE_SIZE = int(os.environ.get("XG_GRID_CACHE_SIZE", "32"))
+# (bins_x, bins_y) grids that may be requested, multiples of the 8:5 pitch. Each new one takes ~80 ms to calculate
+# and up to ~2.5 MB in the cache, so arbitrary sizes would let clients churn the cache.
+XG_GRID_RESOLUTIONS = [(80, 50), (160, 100), (200, 125), (400, 250), (800, 500)]
+# Decimals of the grid values. Keeps the response small, hover xG is shown with two decimals.
+XG_GRID_PRECISION = 4
+
+
+def xg_grid(bins_x: int, bins_y: int, is_header: bool, model_version: int) -> np.ndarray:
+    """
+    xG of a shot from the center of each cell of a bins_x by bins_y grid over the pitch, shape (bins_x, bins_y)
+    """
+    x = (np.arange(bins_x) + 0.5) / bins_x
+    y = (np.arange(bins_y) + 0.5) / bins_y
+    grid_x, grid_y = np.meshgrid(x, y, indexing="ij")
+    header = np.full(grid_x.shape, is_header)
+    return calculate_xg(grid_x, grid_y, header, pitch_length_px=1, pitch_width_px=1, model_version=model_version)
+
+
+@lru_cache(maxsize=XG_GRID_CACHE_SIZE)
+def xg_grid_json(bins_x: int, bins_y: int, is_header: bool, model_version: int) -> bytes:
+    """
+    XGGrid response body. Grids depend only on their parameters, so the serialized body is cached.
+    """
+    logger.info("Calculating xG grid", extra={"bins_x": bins_x, "bins_y": bins_y, "is_header": is_header})
+    values = np.round(xg_grid(bins_x, bins_y, is_header, model_version), XG_GRID_PRECISION).ravel()
+    return orjson.dumps(
+        {
+            "bins_x": bins_x,
+            "bins_y": bins_y,
+            "is_header": is_header,
+            "model_version": model_version,
+            "values": values,
+        },
+        option=orjson.OPT_SERIALIZE_NUMPY,
+    )
@@ -0,0 +1,189 @@
+"""
+Rescores the xG of all stored matches with the current xG model (xg.XG_MODEL_VERSION): match summaries and shot events.
+Matches are read in batches and scored in a process pool, so an API process running the job keeps serving requests.
+Started from POST /internal/xg-recompute, or out of band with:
+    python src/xg_recompute.py
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import logging
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+import numpy as np
+from sqlalchemy import bindparam, func, select, update
+
+from coordinates import load_periods
+from database import get_session_context
+from models import MatchDB, MatchSummary, ShotEvent, TeamStats, XGRecomputeStatus
+from stats import add_action_to_stats, summary_side
+from structured_logging import configure_logging
+from user_cache import analytics_cache
+from xg import XG_MODEL_VERSION, calculate_xg, extract_shots
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Worker processes scoring matches, defaults to the number of CPUs
+XG_RECOMPUTE_WORKERS = int(os.environ["XG_RECOMPUTE_WORKERS"]) if os.environ.get("XG_RECOMPUTE_WORKERS") else None
+XG_RECOMPUTE_BATCH_SIZE = 200
+
+# (match_id, periods, periods_format) sent to a worker, (match_id, summary, [(period, index, xg)]) returned
+MatchPeriods = tuple[str, list[dict], str]
+MatchScores = tuple[str, dict, list[tuple[str, int, float]]]
+
+
+def score_matches(matches: list[MatchPeriods], model_version: int) -> list[MatchScores]:
+    """
+    Calculates summaries and shot xG of a batch of matches with one vectorized calculate_xg call.
+    Runs in a worker process.
+    """
+    match_shots = [(match_id, extract_shots(load_periods(periods, fmt))) for match_id, periods, fmt in matches]
+    actions = [action for _, shots in match_shots for _, _, action in shots]
+    xg = calculate_xg(
+        np.fromiter((action["x"] for action in actions), dtype=np.float64, count=len(actions)),
+        np.fromiter((action["y"] for action in actions), dtype=np.float64, count=len(actions)),
+        np.fromiter((action.get("is_header", False) for action in actions), dtype=bool, count=len(actions)),
+        pitch_length_px=1,
+        pitch_width_px=1,
+        model_version=model_version,
+    ).tolist()
+
+    results = []
+    position = 0
+    for match_id, shots in match_shots:
+        summary = MatchSummary(team=TeamStats(), opponent=TeamStats())
+        shot_scores = []
+        for (period, index, action), shot_xg in zip(shots, xg[position:position + len(shots)]):
+            add_action_to_stats(getattr(summary, summary_side(action)), action, shot_xg)
+            shot_scores.append((period, index, shot_xg))
+        position += len(shots)
+        results.append((match_id, summary.model_dump(), shot_scores))
+    return results
+
+
+class XGRecomputeJob:
+    """
+    The xG recompute job of this process. One runs at a time.
+    """
+
+    def __init__(self):
+        self.status = XGRecomputeStatus(state="idle", model_version=XG_MODEL_VERSION)
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> XGRecomputeStatus:
+        self.status = XGRecomputeStatus(
+            state="running", model_version=XG_MODEL_VERSION, started_at=datetime.now(timezone.utc)
+        )
+        self._task = asyncio.create_task(self._run())
+        return self.status
+
+    async def _run(self) -> None:
+        try:
+            await recompute_xg(self.status)
+            self.status.state = "finished"
+        except Exception as e:
+            logger.exception("xG recompute failed")
+            self.status.state = "failed"
+            self.status.error = str(e)
+        finally:
+            self.status.finished_at = datetime.now(timezone.utc)
+
+
+xg_recompute_job = XGRecomputeJob()
+
+
+async def _read_batch(last_match_id: str) -> list:
+    statement = (
+        select(MatchDB.match_id, MatchDB.user_id, MatchDB.periods, MatchDB.periods_format, MatchDB.updated_at)
+        .where(MatchDB.match_id > last_match_id, MatchDB.xg_model_version.is_distinct_from(XG_MODEL_VERSION))
+        .order_by(MatchDB.match_id)
+        .limit(XG_RECOMPUTE_BATCH_SIZE)
+    )
+    async with get_session_context() as session:
+        return (await session.execute(statement)).all()
+
+
+async def _write_batch(rows: list, scores: list[MatchScores], status: XGRecomputeStatus) -> None:
+    """
+    Stores the new xG of the batch. Matches written since they were read are skipped: the write already scored
+    them with the current model.
+    """
+    read_updated_at = {row.match_id: row.updated_at for row in rows}
+    user_ids = {row.match_id: row.user_id for row in rows}
+    async with get_session_context() as session:
+        locked = await session.execute(
+            select(MatchDB.match_id, MatchDB.updated_at)
+            .where(MatchDB.match_id.in_(list(read_updated_at)))
+            .with_for_update()
+        )
+        unchanged = {match_id for match_id, updated_at in locked if updated_at == read_updated_at[match_id]}
+        scores = [score for score in scores if score[0] in unchanged]
+        if scores:
+            await session.execute(
+                update(MatchDB.__table__)
+                .where(MatchDB.__table__.c.match_id == bindparam("b_match_id"))
+                .values(summary=bindparam("b_summary"), xg_model_version=XG_MODEL_VERSION, updated_at=func.now()),
+                [{"b_match_id": match_id, "b_summary": summary} for match_id, summary, _ in scores],
+            )
+        shot_params = [
+            {"b_match_id": match_id, "b_period": period, "b_index": index, "b_xg": shot_xg}
+            for match_id, _, shot_scores in scores
+            for period, index, shot_xg in shot_scores
+        ]
+        if shot_params:
+            shot_events = ShotEvent.__table__
+            await session.execute(
+                update(shot_events)
+                .where(
+                    shot_events.c.match_id == bindparam("b_match_id"),
+                    shot_events.c.period == bindparam("b_period"),
+                    shot_events.c.action_index == bindparam("b_index"),
+                )
+                .values(xg=bindparam("b_xg")),
+                shot_params,
+            )
+        for user_id in {user_ids[match_id] for match_id, _, _ in scores}:
+            analytics_cache.invalidate_on_commit(session, user_id)
+    status.matches_rescored += len(scores)
+    status.matches_skipped += len(rows) - len(scores)
+
+
+async def recompute_xg(status: XGRecomputeStatus) -> None:
+    """
+    Streams matches not yet scored with the current model in batches of XG_RECOMPUTE_BATCH_SIZE. Up to one batch
+    per worker is scored while the finished batches are written.
+    """
+    loop = asyncio.get_running_loop()
+    workers = XG_RECOMPUTE_WORKERS or os.cpu_count() or 1
+    # spawn, because forking a process with a running event loop and logging thread is unsafe
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        in_flight: list[tuple[list, asyncio.Future]] = []
+        rows = await _read_batch("")
+        while rows or in_flight:
+            if rows:
+                matches = [(row.match_id, row.periods, row.periods_format) for row in rows]
+                in_flight.append((rows, loop.run_in_executor(executor, score_matches, matches, XG_MODEL_VERSION)))
+            if in_flight and (len(in_flight) >= workers or not rows):
+                done_rows, scores = in_flight.pop(0)
+                await _write_batch(done_rows, await scores, status)
+                logger.info(
+                    "Rescored xG",
+                    extra={"matches": status.matches_rescored, "skipped": status.matches_skipped},
+                )
+            rows = await _read_batch(rows[-1].match_id) if rows else []
+    logger.info(
+        "xG recompute complete",
+        extra={"model_version": XG_MODEL_VERSION, "matches": status.matches_rescored, "skipped": status.matches_skipped},
+    )
+
+
+if __name__ == "__main__":
+    configure_logging()
+    asyncio.run(recompute_xg(XGRecomputeStatus(state="running", model_version=XG_MODEL_VERSION)))
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Postgres for the tests that need a database (postgresql+asyncpg://...). They are skipped without it.
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+async def session():
+    """
+    Session in a transaction that is rolled back after the test
+    """
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_async_engine(TEST_DATABASE_URL)
+    async with engine.connect() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.commit()
+        transaction = await conn.begin()
+        yield AsyncSession(bind=conn)
+        await transaction.rollback()
+    await engine.dispose()
@@ -0,0 +1,74 @@
+import asyncio
+
+from fastapi import HTTPException
+import pytest
+
+from admission import AdmissionController, release_after
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_requests_over_the_rate_are_rejected():
+    controller = AdmissionController(rate=0.5, burst=2, max_in_flight=10)
+    for _ in range(2):
+        (await controller.acquire("u1")).release()
+    with pytest.raises(HTTPException) as error:
+        await controller.acquire("u1")
+    assert error.value.status_code == 429
+    assert error.value.headers["Retry-After"] == "2"
+    # Other users have buckets of their own
+    (await controller.acquire("u2")).release()
+    assert controller.stats()["rejected_rate"] == 1
+
+
+async def test_requests_over_the_in_flight_limit_are_rejected():
+    controller = AdmissionController(rate=100, burst=100, max_in_flight=1, max_wait=0)
+    slot = await controller.acquire("u1")
+    with pytest.raises(HTTPException) as error:
+        await controller.acquire("u1")
+    assert error.value.status_code == 429
+    slot.release()
+    (await controller.acquire("u1")).release()
+    assert controller.stats()["rejected_in_flight"] == 1
+
+
+async def test_request_waits_for_a_slot_up_to_max_wait():
+    controller = AdmissionController(rate=100, burst=100, max_in_flight=1, max_wait=1)
+    slot = await controller.acquire("u1")
+    asyncio.get_running_loop().call_later(0.01, slot.release)
+    (await controller.acquire("u1")).release()
+    assert controller.stats()["queued"] == 1
+
+
+async def test_slot_is_released_once():
+    controller = AdmissionController(rate=100, burst=100, max_in_flight=1, max_wait=0)
+    slot = await controller.acquire("u1")
+    slot.release()
+    slot.release()
+    await controller.acquire("u1")
+    with pytest.raises(HTTPException):
+        await controller.acquire("u1")
+
+
+async def chunks(count: int):
+    for n in range(count):
+        yield f"{n}\n"
+
+
+async def test_streamed_body_holds_the_slot_until_sent():
+    controller = AdmissionController(rate=100, burst=100, max_in_flight=1, max_wait=0)
+    slot = await controller.acquire("u1")
+    body = release_after(chunks(3), slot)
+    assert await anext(body) == "0\n"
+    assert not slot.released
+    assert [chunk async for chunk in body] == ["1\n", "2\n"]
+    assert slot.released
+
+
+async def test_slot_is_released_when_the_client_is_gone():
+    controller = AdmissionController(rate=100, burst=100, max_in_flight=1, max_wait=0)
+    slot = await controller.acquire("u1")
+    body = release_after(chunks(3), slot)
+    await anext(body)
+    await body.aclose()
+    assert slot.released
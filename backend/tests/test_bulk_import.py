@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import bulk_import
+from bulk_import import import_matches
+
+SHOT = {"type": "shot", "x": 600, "y": 250, "shot_type": "on-target", "is_header": False, "team": "team"}
+
+
+def match(actions: list[dict], **fields) -> dict:
+    return {"match_name": "m", "date": "2025-01-01", "periods": [{"type": "First Half", "actions": actions}], **fields}
+
+
+@pytest.fixture
+def created_batches(monkeypatch) -> list[list]:
+    """
+    Replaces the insert with one that records the batches it gets
+    """
+    batches = []
+
+    async def create_matches_in_db(matches, session, pitch):
+        batches.append(matches)
+        return [match.match_name for match in matches]
+
+    monkeypatch.setattr(bulk_import, "create_matches_in_db", create_matches_in_db)
+    return batches
+
+
+async def ndjson(*lines: str):
+    for line in lines:
+        yield line.encode()
+
+
+async def json_array(*records: dict):
+    for record in records:
+        yield record
+
+
+@pytest.mark.anyio
+async def test_invalid_actions_are_reported_per_row(created_batches):
+    missing_x = {key: value for key, value in SHOT.items() if key != "x"}
+    result = await import_matches(
+        ndjson(json.dumps(match([SHOT], match_name="ok")), json.dumps(match([SHOT, missing_x], match_name="bad"))),
+        user_id="u1",
+        session=None,
+    )
+    assert result.created == ["ok"]
+    assert [error.row for error in result.errors] == [2]
+    assert "periods.0.actions.1.x" in result.errors[0].error
+
+
+@pytest.mark.anyio
+async def test_invalid_json_and_blank_lines(created_batches):
+    result = await import_matches(
+        ndjson(json.dumps(match([SHOT])), "", "{not json", json.dumps(match([])), ""),
+        user_id="u1",
+        session=None,
+    )
+    assert len(result.created) == 2
+    assert [error.row for error in result.errors] == [2]
+
+
+@pytest.mark.anyio
+async def test_json_array_records(created_batches):
+    result = await import_matches(
+        json_array(match([SHOT]), match([{**SHOT, "shot_type": "wide"}]), {"match_name": "no date"}),
+        user_id="u1",
+        session=None,
+    )
+    assert len(result.created) == 1
+    assert [error.row for error in result.errors] == [2, 3]
+
+
+@pytest.mark.anyio
+async def test_valid_rows_are_inserted_in_batches(created_batches, monkeypatch):
+    monkeypatch.setattr(bulk_import, "BULK_INSERT_BATCH_SIZE", 2)
+    result = await import_matches(
+        ndjson(*(json.dumps(match([SHOT], match_name=str(n))) for n in range(5))),
+        user_id="u1",
+        session=None,
+    )
+    assert result.created == ["0", "1", "2", "3", "4"]
+    assert [len(batch) for batch in created_batches] == [2, 2, 1]
+    assert all(match.user_id == "u1" for batch in created_batches for match in batch)
+
+
+@pytest.mark.anyio
+async def test_extra_action_keys_are_kept(created_batches):
+    await import_matches(ndjson(json.dumps(match([{**SHOT, "xG": 0.3}]))), user_id="u1", session=None)
+    assert created_batches[0][0].periods[0]["actions"][0]["xG"] == 0.3
+
+
+@pytest.mark.anyio
+async def test_header_flag_from_frontend(created_batches):
+    no_flag = {key: value for key, value in SHOT.items() if key != "is_header"}
+    await import_matches(
+        ndjson(json.dumps(match([{**no_flag, "header": True}, no_flag]))), user_id="u1", session=None
+    )
+    first, second = created_batches[0][0].periods[0]["actions"]
+    assert first["is_header"] is True and "header" not in first
+    assert "is_header" not in second
@@ -0,0 +1,79 @@
+import pytest
+
+from coordinates import (
+    FRONTEND_PITCH,
+    load_periods,
+    normalize_periods,
+    pack_periods,
+    scale_periods,
+    store_periods,
+    unpack_periods,
+)
+from models import MatchCreate
+
+
+def validated_periods(actions: list[dict]) -> list[dict]:
+    """
+    Periods as MatchCreate stores them, with coordinates normalized
+    """
+    match = MatchCreate.model_validate(
+        {"match_name": "m", "date": "2025-01-01", "periods": [{"type": "First Half", "actions": actions}]}
+    )
+    return normalize_periods(match.periods, FRONTEND_PITCH)
+
+
+SHOT = {"type": "shot", "x": 600, "y": 250, "shot_type": "on-target", "is_header": False, "team": "team"}
+
+
+@pytest.mark.parametrize(
+    "action",
+    [
+        SHOT,
+        {**SHOT, "xG": 0.3, "header": False},  # Keys the frontend adds
+        {**SHOT, "assist": None},
+        {**SHOT, "assist": {"x": 500, "y": 200, "type": "dribble"}},
+        {**SHOT, "assist": {"x": 500, "y": 200, "type": "assist", "player": "9"}},
+        {**SHOT, "shot_type": "blocked", "is_header": True, "team": "opponent"},
+    ],
+)
+def test_columnar_round_trip_matches_normalized(action):
+    periods = validated_periods([action])
+    assert unpack_periods(pack_periods(periods)) == periods
+
+
+def test_columnar_round_trip_keeps_key_order():
+    periods = validated_periods([{**SHOT, "xG": 0.3, "assist": {"x": 500, "y": 200, "type": "assist"}}])
+    unpacked = unpack_periods(pack_periods(periods))
+    assert list(unpacked[0]["actions"][0]) == list(periods[0]["actions"][0])
+
+
+def test_unpack_leaves_out_missing_fields():
+    # Written before periods were validated, e.g. without shot_type and is_header
+    periods = [{"type": "Extra", "actions": [{"type": "shot", "x": 0.5, "y": 0.5, "team": "team"}]}]
+    action = unpack_periods(pack_periods(periods))[0]["actions"][0]
+    assert action == {"type": "shot", "x": 0.5, "y": 0.5, "team": "team"}
+
+
+def test_unpack_periods_packed_without_extras():
+    packed = pack_periods(validated_periods([SHOT]))
+    del packed[0]["columns"]["extras"]
+    assert unpack_periods(packed) == validated_periods([SHOT])
+
+
+@pytest.mark.parametrize("periods_format", ["pixels", "normalized", "columnar"])
+def test_store_and_load_periods(periods_format):
+    periods = validated_periods([SHOT, {**SHOT, "assist": {"x": 500, "y": 200, "type": "assist"}, "xG": 0.1}])
+    loaded = load_periods(store_periods(periods, periods_format), periods_format)
+    for loaded_action, action in zip(loaded[0]["actions"], periods[0]["actions"]):
+        assert loaded_action.keys() == action.keys()
+        assert loaded_action["x"] == pytest.approx(action["x"], abs=1e-5)
+        assert loaded_action["y"] == pytest.approx(action["y"], abs=1e-5)
+
+
+def test_normalize_and_scale_periods():
+    periods = [{"type": "First Half", "actions": [{**SHOT, "assist": {"x": 400, "y": 125, "type": "assist"}}]}]
+    normalized = normalize_periods(periods, FRONTEND_PITCH)
+    action = normalized[0]["actions"][0]
+    assert (action["x"], action["y"]) == (600 / FRONTEND_PITCH.length, 250 / FRONTEND_PITCH.width)
+    assert (action["assist"]["x"], action["assist"]["y"]) == (0.5, 0.25)
+    assert scale_periods(normalized, FRONTEND_PITCH) == periods
@@ -0,0 +1,60 @@
+from datetime import date, datetime, timedelta, timezone
+import uuid
+
+import pytest
+from sqlalchemy import insert, update
+
+from crud_operations import get_match_page_versions_from_db
+from etags import etag_matches, match_etag, match_list_etag
+from models import MatchDB
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [(None, False), ("", False), ("*", True), ('W/"x"', False), ('"other", W/{etag}', True), ("{etag}", True)],
+)
+def test_etag_matches(if_none_match, expected):
+    etag = match_etag("m1", START)
+    if if_none_match:
+        if_none_match = if_none_match.format(etag=etag)
+    assert etag_matches(if_none_match, etag) is expected
+
+
+def test_match_list_etag_changes_with_any_match_on_the_page():
+    versions = [("a", START), ("b", START)]
+    etag = match_list_etag(versions, 2, None)
+    assert match_list_etag(list(versions), 2, None) == etag
+    assert match_list_etag([("a", START), ("b", START + timedelta(microseconds=1))], 2, None) != etag
+    assert match_list_etag([("a", START), ("c", START)], 2, None) != etag
+    assert match_list_etag(versions, 3, None) != etag
+    assert match_list_etag(versions, 2, "cursor") != etag
+
+
+@pytest.mark.anyio
+async def test_write_committed_out_of_order_changes_list_etag(session):
+    user_id = str(uuid.uuid4())
+    await session.execute(
+        insert(MatchDB),
+        [
+            {
+                "match_id": f"{user_id}-{n}",
+                "user_id": user_id,
+                "match_name": "m",
+                "date": date(2025, 1, n + 1),
+                "periods": [],
+                "updated_at": START + timedelta(minutes=n),
+            }
+            for n in range(3)
+        ],
+    )
+    etag = match_list_etag(await get_match_page_versions_from_db(user_id, session, limit=2), 2, None)
+
+    # A transaction that started before the latest write commits after it: count and max(updated_at) are unchanged
+    await session.execute(
+        update(MatchDB).where(MatchDB.match_id == f"{user_id}-1").values(updated_at=START + timedelta(seconds=90))
+    )
+    versions = await get_match_page_versions_from_db(user_id, session, limit=2)
+    assert [match_id for match_id, _ in versions] == [f"{user_id}-2", f"{user_id}-1", f"{user_id}-0"]
+    assert not etag_matches(etag, match_list_etag(versions, 2, None))
@@ -0,0 +1,113 @@
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+import pytest
+
+import live_sessions
+from live_sessions import LiveMatchBuffer
+
+pytestmark = pytest.mark.anyio
+
+ACTION = {"type": "shot", "x": 0.75, "y": 0.5, "shot_type": "on-target", "team": "team"}
+
+
+@asynccontextmanager
+async def no_session():
+    yield None
+
+
+@pytest.fixture
+def write_errors() -> list[Exception]:
+    return []
+
+
+@pytest.fixture
+def writes(monkeypatch, write_errors) -> list[list]:
+    """
+    Replaces the DB write with one that records the actions it gets, or raises the next error of write_errors
+    """
+    calls = []
+
+    async def append_actions_in_db(match_id, user_id, actions, session):
+        calls.append(actions)
+        if write_errors:
+            raise write_errors.pop(0)
+        return SimpleNamespace(summary={"team": {}}), list(range(len(actions)))
+
+    monkeypatch.setattr(live_sessions, "append_actions_in_db", append_actions_in_db)
+    monkeypatch.setattr(live_sessions, "get_session_context", no_session)
+    monkeypatch.setattr(live_sessions, "LIVE_FLUSH_INTERVAL", 3600)
+    return calls
+
+
+class Connection:
+    """
+    notify callback of a live connection, keeps the messages sent to it
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    async def __call__(self, message: dict) -> None:
+        self.messages.append(message)
+
+
+@pytest.fixture
+async def buffer(writes):
+    buffer = LiveMatchBuffer("m1", "u1")
+    yield buffer
+    await buffer.close()
+
+
+async def test_actions_of_all_connections_are_written_together(buffer, writes):
+    first, second = Connection(), Connection()
+    buffer.add("First Half", ACTION, first, 1)
+    buffer.add("First Half", ACTION, second, 1)
+    buffer.add("Second Half", ACTION, first, 2)
+    await buffer.flush()
+
+    assert len(writes) == 1 and [period for period, _ in writes[0]] == ["First Half", "First Half", "Second Half"]
+    assert [action["seq"] for action in first.messages[0]["actions"]] == [1, 2]
+    assert second.messages[0]["actions"] == [{"seq": 1, "period": "First Half", "action_index": 1}]
+    assert buffer.pending == []
+
+
+async def test_missing_match_drops_actions(buffer, write_errors):
+    connection = Connection()
+    write_errors.append(HTTPException(status_code=404, detail="Match not found"))
+    buffer.add("First Half", ACTION, connection, 1)
+    await buffer.flush()
+    assert connection.messages == [{"type": "error", "detail": "Match not found", "seqs": [1]}]
+    assert buffer.pending == []
+
+
+async def test_failed_write_is_retried(buffer, writes, write_errors):
+    connection = Connection()
+    write_errors.append(ConnectionError())
+    buffer.add("First Half", ACTION, connection, 1)
+    await buffer.flush()
+    assert connection.messages == [] and len(buffer.pending) == 1
+
+    buffer.add("First Half", ACTION, connection, 2)
+    await buffer.flush()
+    assert [len(actions) for actions in writes] == [1, 2]
+    assert [action["seq"] for action in connection.messages[0]["actions"]] == [1, 2]
+
+
+async def test_actions_are_dropped_after_max_retries(buffer, write_errors, monkeypatch):
+    monkeypatch.setattr(live_sessions, "LIVE_FLUSH_MAX_RETRIES", 2)
+    connection = Connection()
+    write_errors.extend([ConnectionError(), ConnectionError()])
+    buffer.add("First Half", ACTION, connection, 1)
+    await buffer.flush()
+    buffer.add("First Half", ACTION, connection, 2)
+    await buffer.flush()
+
+    assert connection.messages == [{"type": "error", "detail": "Actions could not be stored", "seqs": [1, 2]}]
+    assert buffer.pending == []
+    # The next failure starts a new count
+    write_errors.append(ConnectionError())
+    buffer.add("First Half", ACTION, connection, 3)
+    await buffer.flush()
+    assert len(buffer.pending) == 1
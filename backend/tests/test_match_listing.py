@@ -0,0 +1,72 @@
+from datetime import date
+import uuid
+
+from fastapi import HTTPException
+import pytest
+from sqlalchemy import insert
+
+from crud_operations import decode_cursor, encode_cursor, list_matches_from_db
+from models import MatchDB
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def user_id() -> str:
+    return str(uuid.uuid4())
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(date(2025, 3, 1), "a|b")) == (date(2025, 3, 1), "a|b")
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "MjAyNS0wMy0wMQ==", "eHx5"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+async def add_matches(session, user_id: str, keys: list[tuple[date, str]]) -> None:
+    await session.execute(
+        insert(MatchDB),
+        [
+            {"match_id": match_id, "user_id": user_id, "match_name": match_id, "date": match_date, "periods": []}
+            for match_date, match_id in keys
+        ],
+    )
+
+
+async def test_pages_cover_all_matches_newest_first(session, user_id):
+    # Same dates on purpose: match_id breaks the ties
+    keys = [(date(2025, 1, day % 3 + 1), f"{user_id}-m{day:02}") for day in range(7)]
+    await add_matches(session, user_id, keys)
+    await add_matches(session, "u2", [(date(2025, 1, 2), f"{user_id}-other")])
+
+    listed = []
+    cursor = None
+    pages = 0
+    while True:
+        page = await list_matches_from_db(user_id, session, limit=3, cursor=cursor)
+        listed.extend((item.date, item.match_id) for item in page.items)
+        pages += 1
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert listed == sorted(keys, reverse=True)
+    assert pages == 3
+
+
+async def test_last_full_page_has_no_cursor(session, user_id):
+    await add_matches(session, user_id, [(date(2025, 1, 1), f"{user_id}-a"), (date(2025, 1, 2), f"{user_id}-b")])
+    page = await list_matches_from_db(user_id, session, limit=2)
+    assert [item.match_id for item in page.items] == [f"{user_id}-b", f"{user_id}-a"]
+    assert page.next_cursor is None
+
+
+async def test_matches_written_between_pages_are_not_repeated(session, user_id):
+    await add_matches(session, user_id, [(date(2025, 1, day), f"{user_id}-m{day}") for day in range(1, 5)])
+    first = await list_matches_from_db(user_id, session, limit=2)
+    await add_matches(session, user_id, [(date(2025, 2, 1), f"{user_id}-newest")])
+    second = await list_matches_from_db(user_id, session, limit=2, cursor=first.next_cursor)
+    assert [item.match_id for item in second.items] == [f"{user_id}-m2", f"{user_id}-m1"]
@@ -0,0 +1,136 @@
+"""
+Runs against the Postgres in TEST_DATABASE_URL, see conftest.py
+"""
+from datetime import date
+
+from fastapi import HTTPException
+import pytest
+from sqlalchemy import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from coordinates import FRONTEND_PITCH, load_periods, normalize_action
+import crud_operations
+from crud_operations import create_match_in_db
+from models import Action, MatchDB, ShotEvent
+import period_actions
+from period_actions import append_action_in_db, append_actions_in_db, remove_action_from_db
+from stats import get_match_summary
+
+pytestmark = pytest.mark.anyio
+
+SHOT = {"type": "shot", "x": 600, "y": 250, "shot_type": "on-target", "is_header": False, "team": "team"}
+DRIBBLE_SHOT = {**SHOT, "shot_type": "blocked", "assist": {"x": 500, "y": 200, "type": "dribble"}}
+OPPONENT_HEADER = {"type": "shot", "x": 150, "y": 260, "shot_type": "off-target", "is_header": True, "team": "opponent"}
+
+
+@pytest.fixture(params=["normalized", "columnar"])
+def periods_format(request, monkeypatch) -> str:
+    monkeypatch.setattr(crud_operations, "PERIODS_STORAGE_FORMAT", request.param)
+    monkeypatch.setattr(period_actions, "PERIODS_STORAGE_FORMAT", request.param)
+    return request.param
+
+
+async def create_match(session: AsyncSession, actions: list[dict]) -> str:
+    match = MatchDB(
+        match_name="m",
+        date=date(2025, 1, 1),
+        periods=[{"type": "First Half", "actions": actions}],
+        user_id="u1",
+    )
+    return (await create_match_in_db(match, session)).match_id
+
+
+async def assert_consistent(session: AsyncSession, match_id: str) -> list[dict]:
+    """
+    Checks that the stored summary and shot events match a recalculation from the stored periods
+    """
+    match = (await session.scalars(select(MatchDB).where(MatchDB.match_id == match_id))).one()
+    await session.refresh(match)
+    periods = load_periods(match.periods, match.periods_format)
+    expected = get_match_summary(periods).model_dump()
+    for side in ("team", "opponent"):
+        assert match.summary[side] == pytest.approx(expected[side])
+
+    events = (
+        await session.scalars(
+            select(ShotEvent).where(ShotEvent.match_id == match_id).order_by(ShotEvent.period, ShotEvent.action_index)
+        )
+    ).all()
+    shots = sorted(
+        (period["type"], index, action["team"], action["shot_type"])
+        for period in periods
+        for index, action in enumerate(period["actions"])
+    )
+    assert [(e.period, e.action_index, e.team, e.shot_type) for e in events] == shots
+    return periods
+
+
+async def test_append_updates_summary_and_shot_events(session, periods_format):
+    match_id = await create_match(session, [SHOT])
+    result = await append_action_in_db(
+        match_id, "u1", "First Half", Action.model_validate(DRIBBLE_SHOT), session, FRONTEND_PITCH
+    )
+    assert result.action_index == 1
+    result = await append_action_in_db(
+        match_id, "u1", "Second Half", Action.model_validate(OPPONENT_HEADER), session, FRONTEND_PITCH
+    )
+    assert result.action_index == 0
+
+    periods = await assert_consistent(session, match_id)
+    assert [len(period["actions"]) for period in periods] == [2, 1]
+    assert result.summary.opponent.total_shots == 1
+
+
+async def test_remove_shifts_later_actions(session, periods_format):
+    match_id = await create_match(session, [SHOT, DRIBBLE_SHOT, OPPONENT_HEADER])
+    result = await remove_action_from_db(match_id, "u1", "First Half", 0, session)
+    assert result.action_index == 0
+    result = await remove_action_from_db(match_id, "u1", "First Half", -1, session)
+    assert result.action_index == 1
+
+    periods = await assert_consistent(session, match_id)
+    assert [action["shot_type"] for action in periods[0]["actions"]] == ["blocked"]
+    assert result.summary.team.dribbles == 1
+    assert result.summary.opponent.total_shots == 0
+
+
+@pytest.mark.parametrize("period, index", [("First Half", 1), ("First Half", -2), ("Second Half", 0)])
+async def test_remove_missing_action(session, periods_format, period, index):
+    match_id = await create_match(session, [SHOT])
+    with pytest.raises(HTTPException) as error:
+        await remove_action_from_db(match_id, "u1", period, index, session)
+    assert error.value.status_code == 404
+
+
+async def test_other_users_match_is_not_found(session):
+    match_id = await create_match(session, [SHOT])
+    with pytest.raises(HTTPException) as error:
+        await append_action_in_db(match_id, "u2", "First Half", Action.model_validate(SHOT), session)
+    assert error.value.status_code == 404
+
+
+async def test_append_stores_only_sent_fields(session):
+    match_id = await create_match(session, [])
+    no_flag = {key: value for key, value in SHOT.items() if key != "is_header"}
+    await append_action_in_db(match_id, "u1", "First Half", Action.model_validate(no_flag), session, FRONTEND_PITCH)
+    periods = await assert_consistent(session, match_id)
+    assert periods[0]["actions"][0].keys() == no_flag.keys()
+
+
+async def test_pixels_match_is_rewritten_in_storage_format(session, periods_format):
+    match = MatchDB(
+        match_name="m",
+        date=date(2025, 1, 1),
+        periods=[{"type": "First Half", "actions": [SHOT]}],
+        periods_format="pixels",
+        user_id="u1",
+    )
+    session.add(match)
+    await session.flush()
+    match, indexes = await append_actions_in_db(
+        match.match_id, "u1", [("First Half", normalize_action(OPPONENT_HEADER, FRONTEND_PITCH))], session
+    )
+    assert indexes == [1]
+    assert match.periods_format == periods_format
+    periods = await assert_consistent(session, match.match_id)
+    assert periods[0]["actions"][0]["x"] == pytest.approx(SHOT["x"] / FRONTEND_PITCH.length)
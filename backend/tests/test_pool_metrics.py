@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from conftest import TEST_DATABASE_URL
+from pool_metrics import ReadInstrumentedPool, pool_metrics, read_pool_metrics
+
+
+@pytest.mark.anyio
+async def test_read_replica_pool_has_metrics_of_its_own():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_async_engine(TEST_DATABASE_URL, poolclass=ReadInstrumentedPool)
+    read_pool_metrics.attach(engine)
+    primary_checkouts, read_checkouts = pool_metrics.checkouts, read_pool_metrics.checkouts
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+    # Disposing recreates the pool, which must keep recording into read_pool_metrics
+    await engine.dispose()
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+    snapshot = read_pool_metrics.snapshot(engine)
+    await engine.dispose()
+
+    assert read_pool_metrics.checkouts == read_checkouts + 2
+    assert pool_metrics.checkouts == primary_checkouts
+    assert snapshot["checked_out"] == 0 and snapshot["wait_seconds_max"] > 0
@@ -0,0 +1,39 @@
+import time
+
+from token_cache import TokenCache
+
+
+def test_hit_until_exp():
+    cache = TokenCache()
+    payload = {"sub": "u1", "exp": time.time() + 60}
+    cache.put("token", payload)
+    assert cache.get("token") == payload
+    assert cache.get("other") is None
+    assert cache.stats() == {"size": 1, "max_size": 1024, "hits": 1, "misses": 1}
+
+
+def test_expired_token_is_dropped(monkeypatch):
+    cache = TokenCache()
+    now = time.time()
+    cache.put("token", {"sub": "u1", "exp": now + 60})
+    monkeypatch.setattr(time, "time", lambda: now + 60)
+    assert cache.get("token") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_token_without_exp_is_not_cached():
+    cache = TokenCache()
+    cache.put("token", {"sub": "u1"})
+    assert cache.get("token") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = TokenCache(max_size=2)
+    exp = time.time() + 60
+    for token in ("a", "b"):
+        cache.put(token, {"sub": token, "exp": exp})
+    cache.get("a")
+    cache.put("c", {"sub": "c", "exp": exp})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from user_cache import UserCache
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list[float]:
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = UserCache(ttl_seconds=60)
+    cache.put("u1", "season", 1)
+    assert cache.get("u1", "season") == 1
+    clock[0] += 60
+    assert cache.get("u1", "season") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_put_drops_expired_entries_of_the_user(clock):
+    cache = UserCache(ttl_seconds=60)
+    for key in range(10):
+        cache.put("u1", key, key)
+    clock[0] += 60
+    cache.put("u1", "new", 1)
+    assert cache.stats()["entries"] == 1
+
+
+def test_entries_per_user_are_capped(clock):
+    cache = UserCache(max_entries_per_user=2)
+    cache.put("u1", "a", 1)
+    cache.put("u1", "b", 2)
+    cache.get("u1", "a")
+    cache.put("u1", "c", 3)
+    assert cache.get("u1", "b") is None
+    assert cache.get("u1", "a") == 1 and cache.get("u1", "c") == 3
+
+
+def test_least_recently_used_user_is_evicted(clock):
+    cache = UserCache(max_users=2)
+    cache.put("u1", "season", 1)
+    cache.put("u2", "season", 2)
+    cache.get("u1", "season")
+    cache.put("u3", "season", 3)
+    assert cache.get("u2", "season") is None
+    assert cache.stats()["users"] == 2
+
+
+def test_invalidate(clock):
+    cache = UserCache()
+    cache.put("u1", "season", 1)
+    cache.put("u2", "season", 2)
+    cache.invalidate("u1")
+    assert cache.get("u1", "season") is None
+    assert cache.get("u2", "season") == 2
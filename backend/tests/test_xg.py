@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from xg import calculate_match_xg, calculate_xg
+from xg_grid import XG_GRID_RESOLUTIONS, xg_grid
+
+# (x, y, is_header, xG) on the 800x500 pitch, calculated with calculateXG of frontend/utils/expected_goals.js
+FRONTEND_XG = [
+    (700, 250, False, 0.25365860559372055),
+    (700, 250, True, 0.05331542463938617),
+    (600, 100, False, 0.016574011282756332),
+    (400, 250, False, 0.002523165143715114),
+    (790, 220, True, 0.4428259796783782),
+    (650, 450, False, 0.011436717533379891),
+]
+
+
+def test_calculate_xg_matches_frontend():
+    x, y, is_header, expected = zip(*FRONTEND_XG)
+    assert calculate_xg(np.array(x), np.array(y), np.array(is_header)) == pytest.approx(expected, rel=1e-9)
+
+
+def test_shot_on_the_goal_line_is_finite():
+    # calculateXG returns NaN here: the posts are on the line through the shot
+    xg = calculate_xg(np.array([800, 800]), np.array([250, 0]), np.array([False, False]))
+    assert np.isfinite(xg).all()
+
+
+def normalized_shots(shots: list[tuple]) -> list[dict]:
+    return [{"type": "shot", "x": x / 800, "y": y / 500, "is_header": header} for x, y, header, _ in shots]
+
+
+def test_calculate_match_xg_uses_normalized_coordinates():
+    periods = [
+        {"type": "First Half", "actions": normalized_shots(FRONTEND_XG[:3])},
+        {"type": "Second Half", "actions": normalized_shots(FRONTEND_XG[3:])},
+    ]
+    shots, xg = calculate_match_xg(periods)
+    assert [(period, index) for period, index, _ in shots] == [
+        ("First Half", 0),
+        ("First Half", 1),
+        ("First Half", 2),
+        ("Second Half", 0),
+        ("Second Half", 1),
+        ("Second Half", 2),
+    ]
+    assert xg == pytest.approx([expected for *_, expected in FRONTEND_XG], rel=1e-9)
+
+
+@pytest.mark.parametrize("bins_x, bins_y", XG_GRID_RESOLUTIONS)
+def test_xg_grid_cells_match_calculate_xg(bins_x, bins_y):
+    grid = xg_grid(bins_x, bins_y, False, 1)
+    assert grid.shape == (bins_x, bins_y)
+    x, y = bins_x - 1, bins_y // 2
+    expected = calculate_xg([(x + 0.5) / bins_x], [(y + 0.5) / bins_y], [False], 1, 1, model_version=1)[0]
+    assert grid[x, y] == pytest.approx(expected)